@@ -0,0 +1,79 @@
+import os
+import time
+import tempfile
+import threading
+from typing import Optional
+
+import numpy as np
+
+import exrutils
+
+def measure(rgb: np.ndarray, thermal: np.ndarray, directory: Optional[str] = None, repeat: int = 3, **options) -> tuple[float, float, int]:
+    '''Seconds per write, seconds per read and the file size of one frame written with options.'''
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, "frame.exr")
+        start = time.perf_counter()
+        for _ in range(repeat):
+            exrutils.write_dual_image(rgb, thermal, path, **options)
+        write = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            exrutils.read_dual_image(path)
+        read = (time.perf_counter() - start) / repeat
+        return write, read, os.path.getsize(path)
+
+class AutoCompression:
+    '''
+    Picks the strongest lossless codec for the parts set to "auto" that the writers can still encode at the capture rate.
+    Every codec is measured once on a copy of the first frame in a background thread, frames are written with ZIP until
+    that is done. Afterwards the choice follows the measured capture rate.
+    '''
+    def __init__(self, options: dict, writers: int, headroom: float = 1.25, directory: Optional[str] = None):
+        self.options = options
+        self.auto = [i for i in ("visible_compression", "thermal_compression") if options.get(i) == "auto"]
+        self.writers = min(writers, os.cpu_count())
+        self.headroom = headroom
+        self.directory = directory
+        self.candidates: list[tuple[str, float, int]] = [] # (codec, seconds per write, size), strongest first
+        self.measuring: Optional[threading.Thread] = None
+        self.fps = 0.0
+        self.last: Optional[float] = None
+        self.choice = "ZIP"
+
+    def _measure(self, rgb: np.ndarray, thermal: np.ndarray):
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        candidates = []
+        for codec in exrutils.LOSSLESS_COMPRESSIONS:
+            options = self.options | {i: codec for i in self.auto}
+            write, _, size = measure(rgb, thermal, self.directory, **options)
+            candidates.append((codec, write, size))
+        candidates.sort(key=lambda i: i[2])
+        print("Codecs: " + ", ".join(f"{codec} {write*1000:.1f} ms {size/1024:.0f} KiB" for codec, write, size in candidates))
+        self.candidates = candidates
+
+    def __call__(self, rgb: np.ndarray, thermal: np.ndarray) -> dict:
+        '''Write options for the next frame.'''
+        if not self.auto:
+            return self.options
+        if self.measuring is None:
+            self.measuring = threading.Thread(target=self._measure, args=(rgb.copy(), thermal.copy()), daemon=True)
+            self.measuring.start()
+        now = time.monotonic()
+        if self.last is not None and now > self.last:
+            rate = 1.0 / (now - self.last)
+            self.fps = rate if self.fps == 0.0 else 0.9 * self.fps + 0.1 * rate
+        self.last = now
+        candidates = self.candidates
+        if not candidates:
+            return self.options | {i: self.choice for i in self.auto}
+
+        needed = self.fps * self.headroom
+        fitting = [codec for codec, write, _ in candidates if self.writers / write >= needed]
+        # Nothing keeps up, the fastest codec drops the fewest frames
+        self.choice = fitting[0] if fitting else min(candidates, key=lambda i: i[1])[0]
+        return self.options | {i: self.choice for i in self.auto}
+
+    def reset(self):
+        '''Call when recording pauses so the pause does not count as a slow frame.'''
+        self.last = None
@@ -0,0 +1,57 @@
+import argparse
+
+import numpy as np
+
+import exrutils
+from autocodec import measure
+from frameindex import FrameIndex
+
+def synthetic_frames(count: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    # A smooth gradient with sensor noise, close to what the cameras deliver
+    y, x = np.mgrid[0:240, 0:320].astype(np.float32)
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        thermal = 20.0 + x/16.0 + y/24.0 + i*0.1 + rng.normal(0.0, 0.05, x.shape).astype(np.float32)
+        rgb = np.clip(np.repeat(np.kron(thermal, np.ones((2,2), dtype=np.float32))[:,:,None], 3, axis=2) * 4.0 + rng.normal(0.0, 3.0, (480,640,3)), 0, 255).astype(np.uint8)
+        frames.append((rgb, thermal))
+    return frames
+
+def recorded_frames(path: str, count: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    files = FrameIndex.open(path)
+    return [files.read_dual_image(i) for i in np.linspace(0, len(files)-1, min(count, len(files)), dtype=int)]
+
+def raw_bytes(rgb: np.ndarray, thermal: np.ndarray, options: dict) -> int:
+    # The size of the stored pixels without compression
+    visible = exrutils.encode_visible(rgb, options["visible_format"], options["visible_downscale"])
+    thermal, _ = exrutils.encode_thermal(thermal, options["thermal_format"])
+    return visible.nbytes + thermal.nbytes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Codec benchmark", description="Write and read throughput and compression ratio of every EXR codec")
+    parser.add_argument("path", nargs="?", help="Recording to take real frames from, synthetic frames are used without it")
+    parser.add_argument("-n", "--frames", type=int, default=4)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-d", "--dir", help="Directory the frames are written to, defaults to the system temp directory")
+    parser.add_argument("--visible-format", choices=exrutils.VISIBLE_FORMATS, default="float")
+    parser.add_argument("--visible-downscale", type=int, default=1)
+    parser.add_argument("--thermal-format", choices=exrutils.THERMAL_FORMATS, default="float")
+    args = parser.parse_args()
+
+    frames = recorded_frames(args.path, args.frames) if args.path else synthetic_frames(args.frames)
+    options = {"visible_format": args.visible_format, "visible_downscale": args.visible_downscale, "thermal_format": args.thermal_format}
+    raw = sum(raw_bytes(rgb, thermal, options) for rgb, thermal in frames)
+
+    print(f"{len(frames)} {'recorded' if args.path else 'synthetic'} frames, {raw/len(frames)/1e6:.2f} MB per frame uncompressed")
+    print(f"{'codec':<8}{'write MB/s':>12}{'read MB/s':>12}{'ratio':>8}{'lossless':>10}")
+    for codec in exrutils.COMPRESSIONS:
+        write = read = size = 0
+        try:
+            for rgb, thermal in frames:
+                w, r, s = measure(rgb, thermal, args.dir, args.repeat, **options, visible_compression=codec, thermal_compression=codec)
+                write, read, size = write + w, read + r, size + s
+        except ValueError as e:
+            print(f"{codec:<8}{'n/a':>12}  {e}")
+            continue
+        lossless = codec in exrutils.LOSSLESS_COMPRESSIONS
+        print(f"{codec:<8}{raw/write/1e6:>12.1f}{raw/read/1e6:>12.1f}{raw/size:>8.2f}{'yes' if lossless else 'no':>10}")
@@ -0,0 +1,31 @@
+import time
+import argparse
+
+import numpy as np
+
+import imageutils
+
+def per_frame_ms(fn, repeat: int) -> float:
+    fn() # Warm up, builds the lookup table
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Colormap benchmark", description="Per-frame colorization cost of the palette/scale chain and of the lookup tables")
+    parser.add_argument("-s", "--size", default="320x240", help="Thermal frame size, WxH")
+    parser.add_argument("-n", "--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    w, h = map(int, args.size.split("x"))
+    # Same layout as in the player, (x,y,1)
+    arr = np.linspace(20.0, 40.0, w*h, dtype=np.float32).reshape(w, h, 1) + np.random.rand(w, h, 1).astype(np.float32)
+    out = np.empty((w, h, 3), dtype=np.uint8)
+
+    print(f"{'palette':<22}{'scale':<8}{'chain ms':>10}{'LUT ms':>10}{'speedup':>9}")
+    for p, (palette_name, palette) in enumerate(imageutils.COLOR_PALETTES):
+        for s, (scale_name, scale) in enumerate(imageutils.COLOR_SCALES):
+            before = per_frame_ms(lambda: palette(scale(arr)), args.repeat)
+            after = per_frame_ms(lambda: imageutils.colorize(arr, p, s, out=out), args.repeat)
+            print(f"{palette_name:<22}{scale_name:<8}{before:>10.3f}{after:>10.3f}{before/after:>8.1f}x")
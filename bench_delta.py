@@ -0,0 +1,84 @@
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+import exrutils
+import thermalseq
+from frameindex import FrameIndex
+
+def synthetic_frames(count: int, noise: float) -> list[tuple[np.ndarray, np.ndarray]]:
+    # Oil spreading slowly over a heated plate: a static gradient, a moving warm front and a little sensor noise
+    y, x = np.mgrid[0:240, 0:320].astype(np.float32)
+    rng = np.random.default_rng(0)
+    plate = 20.0 + x/16.0 + rng.normal(0.0, 0.2, x.shape).astype(np.float32)
+    rgb = np.clip(np.repeat(np.kron(plate, np.ones((2,2), dtype=np.float32))[:,:,None], 3, axis=2) * 4.0, 0, 255).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        front = 40.0 + i * 0.5
+        thermal = plate + 5.0 / (1.0 + np.exp((np.hypot(x-160, y-120) - front) / 4.0)) + rng.normal(0.0, noise, x.shape).astype(np.float32)
+        frames.append((rgb, thermal.astype(np.float32)))
+    return frames
+
+def recorded_frames(path: str, count: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    files = FrameIndex.open(path)
+    return [files.read_dual_image(i) for i in range(min(count, len(files)))]
+
+def name(i: int) -> str:
+    return thermalseq.frame_name(1700000000000 + i*100, i+1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Delta codec benchmark", description="Size and speed of thermal deltas against one write_dual_image file per frame")
+    parser.add_argument("path", nargs="?", help="Recording to take consecutive frames from, synthetic frames are used without it")
+    parser.add_argument("-n", "--frames", type=int, default=120)
+    parser.add_argument("--noise", type=float, default=0.02, help="Temporal noise of the synthetic frames in °C")
+    parser.add_argument("-k", "--keyframe-interval", type=int, default=30)
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--visible-format", choices=exrutils.VISIBLE_FORMATS, default="uint")
+    parser.add_argument("--thermal-compression", choices=list(exrutils.COMPRESSIONS), default="ZIP", help="Codec of the EXR files")
+    args = parser.parse_args()
+
+    frames = recorded_frames(args.path, args.frames) if args.path else synthetic_frames(args.frames, args.noise)
+    count = len(frames)
+    print(f"{count} {'recorded' if args.path else 'synthetic'} frames, keyframe every {args.keyframe_interval}")
+    print(f"{'layout':<24}{'MB':>9}{'ratio':>8}{'encode ms':>11}{'decode ms':>11}{'seek ms':>9}{'max error':>11}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for thermal_format in exrutils.THERMAL_FORMATS:
+            options = {"visible_format": args.visible_format, "thermal_format": thermal_format}
+
+            # One EXR file per frame, as recorded today
+            directory = os.path.join(tmp, f"exr_{thermal_format}")
+            os.makedirs(directory)
+            start = time.perf_counter()
+            for i, (rgb, thermal) in enumerate(frames):
+                exrutils.write_dual_image(rgb, thermal, os.path.join(directory, name(i)), thermal_compression=args.thermal_compression, **options)
+            encode = time.perf_counter() - start
+            files = FrameIndex.open(directory)
+            size = sum(os.path.getsize(files.path(i)) for i in range(len(files)))
+            results.append((f"EXR {args.thermal_compression} {thermal_format}", files, size, encode))
+
+            path = os.path.join(tmp, f"delta_{thermal_format}{thermalseq.SUFFIX}")
+            writer = thermalseq.DeltaSequenceWriter(path, args.keyframe_interval, args.level)
+            start = time.perf_counter()
+            for i, (rgb, thermal) in enumerate(frames):
+                writer(rgb, thermal, name(i), **options)
+            encode = time.perf_counter() - start
+            writer.close()
+            results.append((f"delta {thermal_format}", thermalseq.SequenceFrameIndex(path), os.path.getsize(path), encode))
+
+        baseline = results[0][2]
+        rng = np.random.default_rng(1)
+        for label, files, size, encode in results:
+            start = time.perf_counter()
+            error = max(float(np.abs(files.read_dual_image(i)[1] - frames[i][1]).max()) for i in range(count))
+            decode = time.perf_counter() - start
+            seeks = rng.integers(0, count, 20)
+            start = time.perf_counter()
+            for i in seeks:
+                files.read_dual_image(int(i))
+            seek = time.perf_counter() - start
+            print(f"{label:<24}{size/1e6:>9.2f}{baseline/size:>8.2f}{encode/count*1000:>11.2f}{decode/count*1000:>11.2f}{seek/len(seeks)*1000:>9.2f}{error:>11.4f}")
@@ -0,0 +1,99 @@
+import os
+import argparse
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import fsutils
+from frameindex import FrameIndex
+from parallel import ordered_map
+from config import config
+
+RANGE_NAME = ".colorrange"
+
+'''
+Fixed color range of a whole recording. One streaming pass sums a fine histogram of every thermal pixel, histograms
+of separate chunks simply add up so the chunks are computed in parallel. The histogram of each frame range is cached
+next to the recording and reused for any percentiles until frames are added.
+'''
+def histogram_params() -> tuple[int, float, float]:
+    return config["range"].getint("bins"), config["stats"].getfloat("hist_min"), config["stats"].getfloat("hist_max")
+
+def histogram_chunk(files: FrameIndex, bins: int, hist_min: float, hist_max: float) -> np.ndarray:
+    hist = np.zeros(bins, dtype=np.int64)
+    factor = bins / (hist_max - hist_min)
+    for i in range(len(files)):
+        # Values outside of the histogram range land in the edge bins
+        index = np.clip(((files.read_thermal(i).reshape(-1) - hist_min) * factor).astype(np.int64), 0, bins-1)
+        hist += np.bincount(index, minlength=bins)
+    return hist
+
+def sequence_histogram(files: FrameIndex, bins: int, hist_min: float, hist_max: float, workers: int = 1, chunk_size: int = 64) -> np.ndarray:
+    chunks = ((files[i:i+chunk_size], bins, hist_min, hist_max) for i in range(0, len(files), chunk_size))
+    hist = np.zeros(bins, dtype=np.int64)
+    for i in ordered_map(histogram_chunk, chunks, workers):
+        hist += i
+    return hist
+
+def percentiles(hist: np.ndarray, hist_min: float, hist_max: float, q: list[float]) -> list[float]:
+    '''Percentiles q (0-100) of the histogram, interpolated linearly inside the bins.'''
+    edges = np.linspace(hist_min, hist_max, len(hist)+1)
+    cumulative = np.concatenate([[0], np.cumsum(hist)]).astype(np.float64)
+    if cumulative[-1] == 0:
+        return [hist_min for _ in q]
+    return [float(np.interp(i / 100.0 * cumulative[-1], cumulative, edges)) for i in q]
+
+def cache_key(files: FrameIndex) -> np.ndarray:
+    return np.array([len(files), files.timestamps[0], files.timestamps[-1], files.frame_numbers[0], files.frame_numbers[-1]], dtype=np.int64)
+
+def cache_path(files: FrameIndex) -> Path:
+    '''One cache per frame range, so exporting part of a recording keeps the histogram of the whole one.'''
+    first, last = 0, len(files)-1
+    return Path(files.directory) / f"{RANGE_NAME}.{files.timestamps[first]}-{files.frame_numbers[first]}.{files.timestamps[last]}-{files.frame_numbers[last]}.npz"
+
+def load(files: FrameIndex, bins: int, hist_min: float, hist_max: float) -> Optional[np.ndarray]:
+    try:
+        with np.load(cache_path(files)) as data:
+            if np.array_equal(data["key"], cache_key(files)) and np.array_equal(data["params"], [bins, hist_min, hist_max]):
+                return data["hist"]
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def save(files: FrameIndex, hist: np.ndarray, bins: int, hist_min: float, hist_max: float):
+    try:
+        with open(cache_path(files), "wb") as f:
+            np.savez(f, key=cache_key(files), params=np.array([bins, hist_min, hist_max]), hist=hist)
+    except OSError:
+        pass # Read only recordings are measured again next time
+
+def color_range(files: FrameIndex, low: Optional[float] = None, high: Optional[float] = None, workers: int = 1, chunk_size: int = 64) -> Optional[tuple[float,float]]:
+    '''Temperatures at the low and high percentiles of the whole recording, defaults from the config. None without frames.'''
+    if not len(files):
+        return None
+    low = config["range"].getfloat("low") if low is None else low
+    high = config["range"].getfloat("high") if high is None else high
+    bins, hist_min, hist_max = histogram_params()
+    hist = load(files, bins, hist_min, hist_max)
+    if hist is None:
+        hist = sequence_histogram(files, bins, hist_min, hist_max, workers, chunk_size)
+        save(files, hist, bins, hist_min, hist_max)
+    lo, hi = percentiles(hist, hist_min, hist_max, [low, high])
+    return lo, hi
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Color range", description="Measures and caches the fixed color range of a recording")
+    parser.add_argument("path")
+    parser.add_argument("--low", type=float, default=config["range"].getfloat("low"), help="Lower percentile")
+    parser.add_argument("--high", type=float, default=config["range"].getfloat("high"), help="Upper percentile")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="Worker processes, 0 uses every core")
+    parser.add_argument("--chunk-size", type=int, default=config["export"].getint("chunk_size"), help="Frames per work item")
+    args = parser.parse_args()
+
+    files, _ = fsutils.file_range(args.path)
+    value_range = color_range(files, args.low, args.high, args.workers if args.workers > 0 else os.cpu_count(), args.chunk_size)
+    if value_range is None:
+        print("No frames found")
+    else:
+        print(f"{args.low:g}% {value_range[0]:.2f} °C, {args.high:g}% {value_range[1]:.2f} °C")
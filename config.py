@@ -6,19 +6,85 @@ DEFAULTS = {
         "camera": 0,
         "auto_record": False,
         "write_path": "out/",
+        "write_stats": True,
+        "ring_slots": 32,
+        "writers": 0,
+        "max_cameras": 2,
+        "backpressure": "block",
+        "visible_format": "float",
+        "visible_downscale": 1,
+        "thermal_format": "float",
+        "thermal_scale": 0.01,
+        "thermal_offset": -100.0,
+        "visible_compression": "ZIP",
+        "thermal_compression": "ZIP",
+        "storage": "exr",
+        "sequence_name": "recording.thseq",
+        "keyframe_interval": 30,
+        "delta_level": 1,
+        "write_queue": 16,
+        "preview_fps": 15.0,
+        "preview_colorize": True,
+        "control_socket": "/tmp/thermal-recorder.sock",
+        "stats_interval": 5.0,
     },
     "player": {
         "auto_play": False,
         "read_path": "out/",
         "color_palette": 0,
         "color_scale": 0,
+        "fixed_range": False,
         "playback_speed": 1.0,
+        "cache_mb": 512,
+        "prefetch_ahead": 8,
+        "prefetch_behind": 3,
+        "prefetch_workers": 2,
     },
     "export": {
         "csv_path": "export/export.csv",
         "png_path": "export/",
+        "png_compression": 3,
+        "fixed_range": False,
+        "video_path": "export/export.mp4",
+        "video_fps": 0.0,
+        "video_fourcc": "mp4v",
         "color_palette": 0,
         "point_color": "yellow",
+        "workers": 1,
+        "chunk_size": 64,
+        "roi_path": "export/rois.json",
+        "roi_stats": "mean,min,max,std",
+        "roi_percentiles": "",
+    },
+    "stats": {
+        "bins": 128,
+        "hist_min": -20.0,
+        "hist_max": 150.0,
+    },
+    "analysis": {
+        "out_path": "analysis/",
+        "isotherm": 30.0,
+        "window": 15,
+        "series": "",
+        "tile_mb": 256,
+    },
+    "front": {
+        "csv_path": "export/front.csv",
+        "isotherm": 30.0,
+        "band": 8,
+        "color": "white",
+    },
+    "filter": {
+        "kind": "none",
+        "ema_alpha": 0.3,
+        "median_window": 5,
+        "kalman_process": 0.001,
+        "kalman_measurement": 0.04,
+    },
+    "range": {
+        "bins": 8192,
+        "low": 1.0,
+        "high": 99.0,
     }
 }
 
@@ -0,0 +1,82 @@
+import zlib
+import struct
+from typing import Optional
+
+import numpy as np
+
+import exrutils
+
+'''
+Thermal frames as keyframes plus per-pixel deltas to the previous frame.
+The deltas are taken between the stored integers (the bits of float32 and half values, or the quantized uint16 values
+of exrutils.encode_thermal) with wrap-around, so float and half are lossless, uint16 is off by at most scale/2 and
+decoding never drifts. The delta bytes are split into byte planes before zlib, like the EXR ZIP predictor.
+'''
+FORMATS = ["float", "half", "uint16"]
+BITS = {"float": np.dtype("<u4"), "half": np.dtype("<u2"), "uint16": np.dtype("<u2")}
+HEADER = struct.Struct("<BBxxiiffq") # keyframe, format, height, width, scale, offset, reference
+
+class Header:
+    def __init__(self, data: bytes):
+        keyframe, format, self.height, self.width, scale, offset, self.reference = HEADER.unpack_from(data)
+        self.keyframe = bool(keyframe)
+        self.format = FORMATS[format]
+        self.quantization = (scale, offset) if self.format == "uint16" else None
+
+def to_bits(thermal: np.ndarray, format: str, quantization: tuple[float,float] = exrutils.THERMAL_QUANTIZATION) -> np.ndarray:
+    thermal = thermal.reshape(thermal.shape[0], thermal.shape[1])
+    if format == "uint16":
+        return exrutils.encode_thermal(thermal, format, quantization)[0].astype(BITS[format])
+    return exrutils.encode_thermal(thermal, format)[0].view(BITS[format])
+
+def from_bits(bits: np.ndarray, header: Header) -> np.ndarray:
+    if header.format == "uint16":
+        return exrutils.decode_thermal(bits, header.quantization)
+    return exrutils.decode_thermal(bits.view(np.float32 if header.format == "float" else np.float16))
+
+def encode(bits: np.ndarray, previous: Optional[np.ndarray], format: str, quantization: tuple[float,float], reference: int = -1, level: int = 1) -> bytes:
+    '''previous None makes a keyframe, reference is stored for the container to find the previous frame.'''
+    delta = bits - previous if previous is not None else bits
+    planes = np.ascontiguousarray(delta.reshape(-1).view(np.uint8).reshape(-1, delta.itemsize).T)
+    scale, offset = quantization if format == "uint16" else (0.0, 0.0)
+    header = HEADER.pack(previous is None, FORMATS.index(format), bits.shape[0], bits.shape[1], scale, offset, reference)
+    return header + zlib.compress(planes, level)
+
+def decode(data: bytes, previous: Optional[np.ndarray]) -> np.ndarray:
+    '''The stored bits of a frame, previous are the bits of the reference frame for deltas.'''
+    header = Header(data)
+    dtype = BITS[header.format]
+    planes = np.frombuffer(zlib.decompress(data[HEADER.size:]), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    bits = np.ascontiguousarray(planes.T).view(dtype).reshape(header.height, header.width)
+    if header.keyframe:
+        return bits
+    if previous is None:
+        raise ValueError("Delta frame without its reference frame")
+    return previous + bits
+
+class DeltaEncoder:
+    '''Keeps the previous frame, every interval-th frame is a keyframe so seeking decodes at most interval frames.'''
+    def __init__(self, format: str = "uint16", quantization: tuple[float,float] = exrutils.THERMAL_QUANTIZATION, interval: int = 30, level: int = 1):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown thermal format {format}, use one of {FORMATS}")
+        self.format = format
+        self.quantization = quantization
+        self.interval = interval
+        self.level = level
+        self.previous: Optional[np.ndarray] = None
+        self.count = 0
+
+    def encode(self, thermal: np.ndarray, reference: int = -1) -> bytes:
+        bits = to_bits(thermal, self.format, self.quantization)
+        if self.previous is not None and (self.count >= self.interval or self.previous.shape != bits.shape):
+            self.previous = None
+        if self.previous is None:
+            self.count = 0
+        data = encode(bits, self.previous, self.format, self.quantization, reference, self.level)
+        self.previous = bits
+        self.count += 1
+        return data
+
+    def reset(self):
+        '''The next frame is a keyframe.'''
+        self.previous = None
@@ -0,0 +1,181 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional
+
+import cv2
+import numpy as np
+
+from frameindex import FrameIndex
+from config import config
+
+FILTERS = ["none", "ema", "median", "kalman"]
+
+'''
+Per-pixel temporal filters for thermal frames. Each one keeps its state between calls, so a frame costs the same no
+matter how long the sequence is and frames are never read twice. Filters work on any array as long as every call
+passes the same pixels, the state starts over when the shape changes and after reset(), call it after seeking.
+Every call returns a new float32 array, the input is never modified.
+'''
+class TemporalFilter(ABC):
+    warmup = 0 # Frames until the output no longer depends on where filtering started
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.state: Optional[np.ndarray] = None
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        frame = np.asarray(frame, dtype=np.float32)
+        if self.state is None or self.state.shape != frame.shape:
+            self.reset()
+            return self.start(frame)
+        return self.update(frame)
+
+    def start(self, frame: np.ndarray) -> np.ndarray:
+        self.state = frame.copy()
+        return frame.copy()
+
+    @abstractmethod
+    def update(self, frame: np.ndarray) -> np.ndarray:
+        '''Filters frame, state holds the previous frames.'''
+
+class EmaFilter(TemporalFilter):
+    '''Exponential moving average, alpha is the weight of the newest frame.'''
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.warmup = math.ceil(math.log(1e-3) / math.log(1.0 - alpha)) if 0.0 < alpha < 1.0 else 0
+        super().__init__()
+
+    def update(self, frame: np.ndarray) -> np.ndarray:
+        cv2.accumulateWeighted(frame, self.state, self.alpha)
+        return self.state.copy()
+
+class MedianFilter(TemporalFilter):
+    '''
+    Median of the last window frames. The frames are kept in a ring buffer and their values per pixel in a sorted
+    stack, every frame removes the oldest value from the stack and inserts the new one with elementwise min/max, so a
+    frame costs O(window) passes.
+    '''
+    def __init__(self, window: int):
+        self.window = window
+        self.warmup = window - 1
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.count = 0 # Frames in the ring
+        self.head = 0 # Slot of the oldest frame once the ring is full
+
+    def start(self, frame: np.ndarray) -> np.ndarray:
+        self.state = frame # Only marks the shape
+        self.stack = np.empty((self.window,) + frame.shape, dtype=np.float32)
+        self.frames = np.empty_like(self.stack)
+        self.scratch = np.empty_like(frame)
+        self.mask = np.empty(frame.shape, dtype=np.uint8)
+        return self.update(frame)
+
+    def update(self, frame: np.ndarray) -> np.ndarray:
+        stack, n = self.stack, self.count
+        if n == self.window:
+            # Entries from the position of the oldest value on move down by one
+            old = self.frames[self.head]
+            for i in range(n-1):
+                cv2.compare(stack[i], old, cv2.CMP_GE, dst=self.mask)
+                cv2.copyTo(stack[i+1], self.mask, dst=stack[i])
+            self.frames[self.head] = frame
+            self.head = (self.head + 1) % self.window
+            n -= 1
+        else:
+            self.frames[n] = frame
+        # Inserting x into the sorted a gives max(a[i-1], min(x, a[i])) at i
+        if n:
+            np.maximum(stack[n-1], frame, out=stack[n])
+            for i in range(n-1, 0, -1):
+                np.minimum(frame, stack[i], out=self.scratch)
+                np.maximum(stack[i-1], self.scratch, out=stack[i])
+            np.minimum(frame, stack[0], out=stack[0])
+        else:
+            stack[0] = frame
+        self.count = n = n + 1
+
+        if n % 2:
+            return stack[n//2].copy()
+        return (stack[n//2-1] + stack[n//2]) * np.float32(0.5)
+
+class KalmanFilter(TemporalFilter):
+    '''
+    Kalman filter of a constant temperature with random walk per pixel, process and measurement are variances in °C².
+    Every pixel keeps its own variance. An innovation beyond gate standard deviations of what the filter expects is
+    taken as a real temperature change and raises the variance of that pixel, so moving edges follow within a frame or
+    two while still pixels keep being smoothed.
+    '''
+    def __init__(self, process: float, measurement: float, gate: float = 3.0):
+        self.process = process
+        self.measurement = measurement
+        self.gate = gate
+        # Frames until the gain of still pixels is within 0.1% of its steady state
+        steady = (-process + math.sqrt(process*process + 4*process*measurement)) / 2 + process
+        gain = steady / (steady + measurement)
+        self.warmup = math.ceil(math.log(1e-3) / math.log(1.0 - gain)) if 0.0 < gain < 1.0 else 0
+        super().__init__()
+
+    def start(self, frame: np.ndarray) -> np.ndarray:
+        self.variance = np.full(frame.shape, self.measurement, dtype=np.float32)
+        self.innovation = np.empty_like(frame)
+        self.gain = np.empty_like(frame)
+        return super().start(frame)
+
+    def update(self, frame: np.ndarray) -> np.ndarray:
+        innovation, gain, variance = self.innovation, self.gain, self.variance
+        np.subtract(frame, self.state, out=innovation)
+        variance += self.process
+        # The squared innovation is expected to be variance + measurement, the excess beyond the gate is the change
+        np.square(innovation, out=gain)
+        gain *= 1.0 / (self.gate * self.gate)
+        gain -= self.measurement
+        np.maximum(variance, gain, out=variance)
+        np.add(variance, self.measurement, out=gain)
+        np.divide(variance, gain, out=gain)
+        variance *= 1.0 - gain
+        innovation *= gain
+        self.state += innovation
+        return self.state.copy()
+
+def make_filter(kind: Optional[str] = None) -> Optional[TemporalFilter]:
+    '''The filter kind with its parameters from the config, None for "none".'''
+    kind = kind or config["filter"].get("kind")
+    if kind == "ema":
+        return EmaFilter(config["filter"].getfloat("ema_alpha"))
+    if kind == "median":
+        return MedianFilter(config["filter"].getint("median_window"))
+    if kind == "kalman":
+        return KalmanFilter(config["filter"].getfloat("kalman_process"), config["filter"].getfloat("kalman_measurement"))
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown filter {kind}, use one of {FILTERS}")
+
+def chunks(length: int, chunk_size: int, denoise: Optional[TemporalFilter]) -> Iterator[tuple[int, int, int]]:
+    '''
+    (start, skip, stop) of work items that are filtered independently: frames start..stop are filtered and the first
+    skip of them only warm the filter up, so the output matches filtering the whole sequence in one go (exactly for
+    the median, within 0.1% of the difference at the chunk start for the others).
+    '''
+    warmup = denoise.warmup if denoise else 0
+    for i in range(0, length, chunk_size):
+        start = max(i - warmup, 0)
+        yield start, i - start, min(i + chunk_size, length)
+
+def thermal_frames(files: FrameIndex, denoise: Optional[TemporalFilter] = None, skip: int = 0) -> Iterator[tuple[int, np.ndarray]]:
+    '''(index, (y,x) thermal frame) of files from skip on, filtered from the first frame if denoise is given.'''
+    if denoise is not None:
+        denoise.reset()
+    for i in range(len(files)):
+        if denoise is None and i < skip:
+            continue
+        thermal = files.read_thermal(i)
+        thermal = thermal.reshape(thermal.shape[0], thermal.shape[1])
+        if denoise is not None:
+            thermal = denoise(thermal)
+        if i >= skip:
+            yield i, thermal
@@ -1,83 +1,233 @@
 import os
 import argparse
+import functools
+import importlib.util
 from typing import Optional
 from pathlib import Path
 
-import exrutils
+import cv2
+import numpy as np
+
 import fsutils
+import imageutils
+import colorrange
+import front
+import roi
+from parallel import ordered_map
+from roi import RoiStats
+from denoise import FILTERS, TemporalFilter, make_filter, thermal_frames, chunks as denoise_chunks
+from frameindex import FrameIndex
+from framestats import FrameStats
 from config import config
 
-def export_values(files: list[str], point: Optional[tuple[int,int]], outpath: str, min=False, max=False):
+def value_lines(files: FrameIndex, points: list[tuple[int,int]], min=False, max=False, stats: Optional[RoiStats] = None, extrema: Optional[np.ndarray] = None, denoise: Optional[TemporalFilter] = None, skip: int = 0) -> str:
+    '''
+    extrema: records from the frame statistics table, min and max are then taken from it
+    denoise: temporal filter of the whole frames, the first skip frames only warm it up
+    '''
+    lines = ""
+    frames = thermal_frames(files, denoise, skip) if denoise else ((i, None) for i in range(skip, len(files)))
+    for i, thermal in frames:
+        if thermal is None and (min or max) and extrema is None:
+            thermal = files.read_thermal(i)
+        line = f"{files.timestamps[i]}, {files.frame_numbers[i]}"
+        if points:
+            if thermal is None:
+                values = files.read_pixels(i, np.array(points)) # Only the chunks holding the points are decoded
+            else:
+                values = thermal[[p[1] for p in points], [p[0] for p in points]] # I don't need to transpose since I swap coordinates here
+            for v in values:
+                line += f", {v}"
+        if min:
+            line += f", {thermal.min() if extrema is None else extrema['min'][i]}"
+        if max:
+            line += f", {thermal.max() if extrema is None else extrema['max'][i]}"
+        if stats:
+            band = thermal[stats.rows[0]:stats.rows[1]] if thermal is not None else files.read_thermal(i, stats.rows)
+            for v in stats(band).ravel():
+                line += f", {v}"
+        lines += line + "\n"
+    return lines
+
+def export_values(files: FrameIndex, points: list[tuple[int,int]], outpath: str, min=False, max=False, workers=1, chunk_size=64, stats: Optional[RoiStats] = None, denoise: Optional[TemporalFilter] = None):
     header = "timestamp, frame"
-    if point: header += f", t({point[0]};{point[1]})"
+    for point in points: header += f", t({point[0]};{point[1]})"
     if min: header += ", min"
     if max: header += ", max"
+    if stats: header += "".join(f", {i}" for i in stats.columns())
     os.makedirs(os.path.dirname(outpath), exist_ok=True)
+
+    extrema = None
+    table = FrameStats.open(files.directory) if (min or max) and not denoise else None # The table holds unfiltered values
+    if table:
+        extrema = table.lookup(files)
+        if not points and not stats:
+            workers = 1 # Everything comes from the statistics table, no frame is decoded
+
+    chunks = ((files[start:stop], points, min, max, stats, extrema[start:stop] if extrema is not None else None, denoise, skip) for start, skip, stop in denoise_chunks(len(files), chunk_size, denoise))
     with open(outpath, "w") as f:
         f.write(header + "\n")
-        for i in files:
-            basename = os.path.basename(i)
-            timestamp = int(basename.split(":")[0])
-            frame_number = int(basename.split(":")[1].removesuffix(".exr"))
-            _, thermal = exrutils.read_dual_image(i)
-            line = f"{timestamp}, {frame_number}"
-            if point:
-                line += f", {thermal[point[1],point[0]]}" # I don't need to transpose since I swap coordinates here
-            if min:
-                line += f", {thermal.min()}"
-            if max:
-                line += f", {thermal.max()}"
-            f.write(line + "\n")
-
-def export_color(files: list[str], point: Optional[tuple[int,int]], outpath: str, color_palette: int, min=False, max=False):
-    import pygame as pg
-    import numpy as np
-    import imageutils
+        for lines in ordered_map(value_lines, chunks, workers):
+            f.write(lines)
 
-    outpath = Path(outpath)
+# RGB of the point colors without pygame, cv2 draws in BGR
+BASIC_COLORS = {
+    "black": (0, 0, 0),
+    "white": (255, 255, 255),
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "cyan": (0, 255, 255),
+    "magenta": (255, 0, 255),
+    "orange": (255, 165, 0),
+}
+
+@functools.lru_cache(maxsize=None)
+def named_colors() -> dict[str, tuple[int,int,int]]:
+    '''Every pygame color name, read from pygame's colordict without importing (and initializing) pygame.'''
+    try:
+        spec = importlib.util.find_spec("pygame")
+        path = os.path.join(spec.submodule_search_locations[0], "colordict.py")
+        module = importlib.util.module_from_spec(importlib.util.spec_from_file_location("_pygame_colordict", path))
+        module.__spec__.loader.exec_module(module)
+        return {name: tuple(rgba[:3]) for name, rgba in module.THECOLORS.items()}
+    except (AttributeError, ImportError, OSError, TypeError):
+        return BASIC_COLORS
+
+def point_color(name: str) -> tuple[int,int,int]:
+    '''RGB of a pygame color name or #rrggbb, raises ValueError for unknown colors.'''
+    if name.startswith("#") and len(name) == 7:
+        return int(name[1:3], 16), int(name[3:5], 16), int(name[5:7], 16)
+    key = name.lower().replace(" ", "")
+    colors = named_colors()
+    if key not in colors:
+        raise ValueError(f"Unknown color {name}, use a pygame color name or #rrggbb")
+    return colors[key]
+
+def draw_point(bgr: np.ndarray, pos: tuple[int,int], color: str):
+    r, g, b = point_color(color)
+    cv2.circle(bgr, (int(pos[0]), int(pos[1])), 2, (b, g, r), -1, cv2.LINE_AA)
+
+def render_color(thermal: np.ndarray, points: list[tuple[int,int]], color_palette: int, min=False, max=False, value_range: Optional[tuple[float,float]] = None) -> np.ndarray:
+    '''Colorized (y,x) thermal image as BGR with the points and the extrema marked, value_range fixes the colors of every frame.'''
+    bgr = cv2.cvtColor(imageutils.colorize(thermal, color_palette, 0, value_range), cv2.COLOR_RGB2BGR)
+    if min:
+        y, x = np.unravel_index(thermal.argmin(), thermal.shape)
+        draw_point(bgr, (x, y), "blue")
+    if max:
+        y, x = np.unravel_index(thermal.argmax(), thermal.shape)
+        draw_point(bgr, (x, y), "red")
+    for point in points:
+        draw_point(bgr, point, config["export"]["point_color"])
+    return bgr
+
+def color_pngs(files: FrameIndex, points: list[tuple[int,int]], outpath: Path, color_palette: int, min: bool, max: bool, compression: int, value_range: Optional[tuple[float,float]], denoise: Optional[TemporalFilter] = None, skip: int = 0) -> int:
+    for i, thermal in thermal_frames(files, denoise, skip):
+        name = os.path.basename(files.names[i]).removesuffix(".exr") + ".png"
+        cv2.imwrite(str(outpath / name), render_color(thermal, points, color_palette, min, max, value_range), [cv2.IMWRITE_PNG_COMPRESSION, compression])
+    return len(files) - skip
 
+def color_frames(files: FrameIndex, points: list[tuple[int,int]], color_palette: int, min: bool, max: bool, value_range: Optional[tuple[float,float]], denoise: Optional[TemporalFilter] = None, skip: int = 0) -> list[np.ndarray]:
+    return [render_color(thermal, points, color_palette, min, max, value_range) for _, thermal in thermal_frames(files, denoise, skip)]
+
+def export_color(files: FrameIndex, points: list[tuple[int,int]], outpath: str, color_palette: int, min=False, max=False, workers=1, chunk_size=64, compression=3, value_range: Optional[tuple[float,float]] = None, denoise: Optional[TemporalFilter] = None):
+    '''Writes one pseudo-colored PNG per frame, compression is the zlib level 0-9.'''
+    outpath = Path(outpath)
     os.makedirs(outpath, exist_ok=True)
-    for i in files:
-        _, thermal = exrutils.read_dual_image(i)
-        thermal = thermal.reshape(thermal.shape[0], thermal.shape[1], 1).transpose((1,0,2))
-        rgb = imageutils.COLOR_PALETTES[color_palette][1](imageutils.COLOR_SCALES[0][1](thermal))
-        surface = pg.surfarray.make_surface(rgb)
-        def draw_point(pos: tuple[int,int], color: pg.Color):
-            pg.draw.circle(surface, color, pos, 2.0)
-        if min:
-            mini = np.unravel_index(thermal.argmin(), thermal.shape)
-            draw_point((mini[0],mini[1]), pg.colordict.THECOLORS["blue"])
-        if max:
-            maxi = np.unravel_index(thermal.argmax(), thermal.shape)
-            draw_point((maxi[0],maxi[1]), pg.colordict.THECOLORS["red"])
-        if point:
-            draw_point(point, pg.colordict.THECOLORS[config["export"]["point_color"]])
-        pg.image.save(surface, outpath / (os.path.basename(i).removesuffix(".exr")+".png"))
+    chunks = ((files[start:stop], points, outpath, color_palette, min, max, compression, value_range, denoise, skip) for start, skip, stop in denoise_chunks(len(files), chunk_size, denoise))
+    for _ in ordered_map(color_pngs, chunks, workers):
+        pass
+
+def recorded_fps(files: FrameIndex) -> float:
+    '''Mean frame rate of the recording from its timestamps.'''
+    duration = (files.timestamps[-1] - files.timestamps[0]) / 1000.0 if len(files) > 1 else 0.0
+    return (len(files) - 1) / duration if duration > 0 else 30.0
+
+def export_video(files: FrameIndex, points: list[tuple[int,int]], outpath: str, color_palette: int, min=False, max=False, workers=1, chunk_size=64, fps=0.0, fourcc="mp4v", value_range: Optional[tuple[float,float]] = None, denoise: Optional[TemporalFilter] = None):
+    '''Streams the pseudo-colored frames into one video file, fps 0 plays at the recorded rate.'''
+    if not len(files):
+        return
+    os.makedirs(os.path.dirname(outpath) or ".", exist_ok=True)
+    fps = fps if fps > 0 else recorded_fps(files)
+    chunks = ((files[start:stop], points, color_palette, min, max, value_range, denoise, skip) for start, skip, stop in denoise_chunks(len(files), chunk_size, denoise))
+    writer = None
+    try:
+        for frames in ordered_map(color_frames, chunks, workers):
+            for bgr in frames:
+                if writer is None:
+                    writer = cv2.VideoWriter(outpath, cv2.VideoWriter_fourcc(*fourcc), fps, (bgr.shape[1], bgr.shape[0]))
+                    if not writer.isOpened():
+                        raise RuntimeError(f"Could not open {outpath} for writing with codec {fourcc}")
+                writer.write(bgr)
+    finally:
+        if writer is not None:
+            writer.release()
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(prog="Exporter", description="This program exports thermal data from select points of a video into .csv format or creates a pseudo-colored png")
-    parser.add_argument("type", choices=['csv', 'png'])
+    parser = argparse.ArgumentParser(prog="Exporter", description="This program exports thermal data from select points of a video into .csv format, creates pseudo-colored pngs or a video, or tracks an isotherm front")
+    parser.add_argument("type", choices=['csv', 'png', 'video', 'front'])
     parser.add_argument("start_path")
     parser.add_argument("end_path", nargs='?')
     parser.add_argument("-o", "--out")
-    parser.add_argument("-p", "--point")
+    parser.add_argument("-p", "--point", action="append", default=[], help="x,y can be repeated")
+    parser.add_argument("-r", "--roi", help="JSON file with points, rectangles and polygons")
+    parser.add_argument("--stats", default=config["export"]["roi_stats"], help="Statistics for every ROI")
+    parser.add_argument("--percentiles", default=config["export"]["roi_percentiles"], help="Percentiles for every ROI, e.g. 5,50,95")
     parser.add_argument("--min", action="store_true")
     parser.add_argument("--max", action="store_true")
     parser.add_argument("-c", "--color", type=int, default=config["export"]["color_palette"])
+    parser.add_argument("-j", "--workers", type=int, default=config["export"].getint("workers"), help="Worker processes, 0 uses every core")
+    parser.add_argument("--chunk-size", type=int, default=config["export"].getint("chunk_size"), help="Frames per work item")
+    parser.add_argument("--png-compression", type=int, choices=range(10), default=config["export"].getint("png_compression"), help="zlib level, 0 is fastest")
+    parser.add_argument("--fps", type=float, default=config["export"].getfloat("video_fps"), help="Video frame rate, 0 uses the recorded rate")
+    parser.add_argument("--fixed-range", action=argparse.BooleanOptionalAction, default=config["export"].getboolean("fixed_range"), help="Color every frame on the 1st to 99th percentile of the whole recording")
+    parser.add_argument("--filter", choices=FILTERS, default=config["filter"].get("kind"), help="Temporal noise filter of every pixel")
+    parser.add_argument("--isotherm", type=float, default=config["front"].getfloat("isotherm"), help="Front temperature in °C")
+    parser.add_argument("--band", type=int, default=config["front"].getint("band"), help="Pixels searched around the previous front")
+    parser.add_argument("--falling", action="store_true", help="Track the region below the isotherm")
+    parser.add_argument("--fourcc", default=config["export"].get("video_fourcc"), help="Video codec")
 
     args = parser.parse_args()
 
-    point = None
-    if args.point:
-        point = tuple(map(int, args.point.split(",")))
+    if args.workers <= 0:
+        args.workers = os.cpu_count()
+    try:
+        point_color(config["export"]["point_color"])
+    except ValueError as e:
+        parser.error(str(e))
+
+    points = [roi.parse_point(i) for i in args.point]
+    regions = []
+    if args.roi:
+        file_points, regions = roi.split_rois(roi.load_rois(args.roi))
+        points += file_points
 
     if args.type == "csv":
         if not args.out:
             args.out = config["export"]["csv_path"]
-        export_values(fsutils.file_range_sharp_start(args.start_path, args.end_path), point, args.out, args.min, args.max)
+        files = fsutils.file_range_sharp_start(args.start_path, args.end_path)
+        stats = None
+        if regions:
+            stats = roi.RoiStats(regions, files.read_thermal(0).shape, [i for i in args.stats.split(",") if i], [float(i) for i in args.percentiles.split(",") if i])
+        export_values(files, points, args.out, args.min, args.max, args.workers, args.chunk_size, stats, make_filter(args.filter))
 
     elif args.type == "png":
         if not args.out:
             args.out = config["export"]["png_path"]
-        export_color(fsutils.file_range_sharp_start(args.start_path, args.end_path), point, args.out, args.color, args.min, args.max)
+        files = fsutils.file_range_sharp_start(args.start_path, args.end_path)
+        value_range = colorrange.color_range(files, workers=args.workers, chunk_size=args.chunk_size) if args.fixed_range else None
+        export_color(files, points, args.out, args.color, args.min, args.max, args.workers, args.chunk_size, args.png_compression, value_range, make_filter(args.filter))
+
+    elif args.type == "video":
+        if not args.out:
+            args.out = config["export"]["video_path"]
+        files = fsutils.file_range_sharp_start(args.start_path, args.end_path)
+        value_range = colorrange.color_range(files, workers=args.workers, chunk_size=args.chunk_size) if args.fixed_range else None
+        export_video(files, points, args.out, args.color, args.min, args.max, args.workers, args.chunk_size, args.fps, args.fourcc, value_range, make_filter(args.filter))
+
+    elif args.type == "front":
+        if not args.out:
+            args.out = config["front"]["csv_path"]
+        front.export_front(fsutils.file_range_sharp_start(args.start_path, args.end_path), args.out, args.isotherm, args.band, not args.falling)
@@ -1,3 +1,9 @@
+import os
+import zlib
+import struct
+import contextlib
+from typing import BinaryIO, Optional
+
 import OpenEXR
 import numpy as np
 
@@ -6,6 +12,34 @@ STD_HEADER = {
     "type" : OpenEXR.scanlineimage
 }
 
+# Codecs by name, PXR24 is lossy for float channels and DWAA/DWAB for float and half channels.
+# B44/B44A only compress half channels so they are only accepted for half parts.
+COMPRESSIONS = {
+    "NONE": OpenEXR.NO_COMPRESSION,
+    "RLE": OpenEXR.RLE_COMPRESSION,
+    "ZIPS": OpenEXR.ZIPS_COMPRESSION,
+    "ZIP": OpenEXR.ZIP_COMPRESSION,
+    "PIZ": OpenEXR.PIZ_COMPRESSION,
+    "PXR24": OpenEXR.PXR24_COMPRESSION,
+    "B44": OpenEXR.B44_COMPRESSION,
+    "B44A": OpenEXR.B44A_COMPRESSION,
+    "DWAA": OpenEXR.DWAA_COMPRESSION,
+    "DWAB": OpenEXR.DWAB_COMPRESSION,
+}
+LOSSLESS_COMPRESSIONS = ["NONE", "RLE", "ZIPS", "ZIP", "PIZ"]
+
+def compression(name: str, dtype: np.dtype):
+    name = name.upper()
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {name}, use one of {list(COMPRESSIONS)}")
+    if name in ("B44", "B44A") and dtype != np.float16:
+        raise ValueError(f"{name} only compresses half data, not {np.dtype(dtype).name}")
+    return COMPRESSIONS[name]
+
+# Float attributes are only 32 bit, capture times are stored as text
+def capture_time_attribute(ms: float) -> str:
+    return f"{ms:.3f}"
+
 v2i = tuple[int,int]
 
 def v2i_add(a: v2i, b: v2i, c: v2i = (0,0)) -> v2i:
@@ -17,11 +51,74 @@ def v2i_max(a: v2i, b:v2i) -> v2i:
 def v2i_min(a: v2i, b:v2i) -> v2i:
     return (min(a[0],b[0]), min(a[1],b[1]))
 
+# Storage precision
+# visible: "float" (float32), "half" (float16) or "uint" (the 8 bit camera values in a UINT channel, read back as value/255)
+# thermal: "float", "half" or "uint16" (round((t - offset)/scale) in a UINT channel, scale and offset are stored in the header)
+# The readers return float32 for every layout.
+VISIBLE_FORMATS = ["float", "half", "uint"]
+THERMAL_FORMATS = ["float", "half", "uint16"]
+THERMAL_QUANTIZATION = (0.01, -100.0) # (scale, offset), 0.01°C steps from -100°C to 555°C
+
+def downscale(image: np.ndarray, factor: int) -> np.ndarray:
+    if factor <= 1:
+        return image
+    h, w = image.shape[0]//factor, image.shape[1]//factor
+    blocks = image[:h*factor, :w*factor].reshape((h, factor, w, factor) + image.shape[2:])
+    return blocks.mean(axis=(1,3), dtype=np.float32)
+
+def encode_visible(rgb_image: np.ndarray, format: str = "float", factor: int = 1) -> np.ndarray:
+    integer = rgb_image.dtype == np.uint8
+    rgb_image = downscale(rgb_image, factor)
+    if format == "uint":
+        return (rgb_image if integer and factor <= 1 else np.rint(rgb_image if integer else rgb_image*255.0)).astype(np.uint32)
+    if integer:
+        rgb_image = rgb_image / np.float32(255.0)
+    if format == "half":
+        return rgb_image.astype(np.float16)
+    if format == "float":
+        return rgb_image.astype(np.float32, copy=False)
+    raise ValueError(f"Unknown visible format {format}, use one of {VISIBLE_FORMATS}")
+
+def encode_thermal(thermal_image: np.ndarray, format: str = "float", quantization: tuple[float,float] = THERMAL_QUANTIZATION) -> tuple[np.ndarray, dict]:
+    if format == "uint16":
+        scale, offset = np.float32(quantization[0]), np.float32(quantization[1])
+        quantized = np.clip(np.rint((thermal_image - offset) / scale), 0, 65535).astype(np.uint32)
+        return quantized, {"thermalScale": float(scale), "thermalOffset": float(offset)}
+    if format == "half":
+        return thermal_image.astype(np.float16), {}
+    if format == "float":
+        return thermal_image.astype(np.float32, copy=False), {}
+    raise ValueError(f"Unknown thermal format {format}, use one of {THERMAL_FORMATS}")
+
+def stored_thermal(thermal_image: np.ndarray, format: str = "float", quantization: tuple[float,float] = THERMAL_QUANTIZATION) -> np.ndarray:
+    '''The float32 values thermal_image reads back as after it is stored in format.'''
+    pixels, attributes = encode_thermal(thermal_image, format, quantization)
+    return decode_thermal(pixels, (attributes["thermalScale"], attributes["thermalOffset"]) if attributes else None)
+
+def decode_visible(pixels: np.ndarray) -> np.ndarray:
+    if pixels.dtype == np.uint32:
+        return pixels.astype(np.float32) / np.float32(255.0)
+    return pixels.astype(np.float32, copy=False)
+
+def decode_thermal(pixels: np.ndarray, quantization: Optional[tuple[float,float]] = None) -> np.ndarray:
+    if quantization:
+        return pixels.astype(np.float32) * np.float32(quantization[0]) + np.float32(quantization[1])
+    return pixels.astype(np.float32, copy=False)
+
 '''
 rgb_pos:        (x,y)
 thermal_pos:    (x,y)
+rgb_image can be float or uint8, the storage precision is chosen by the format arguments
+visible_compression and thermal_compression are COMPRESSIONS names and override the header
+visible_time and thermal_time are the capture times (ms since the epoch) stored in the captureTime attribute of each part
+camera is the chip id of the thermal camera, stored in the cameraId attribute of both parts
 '''
-def write_dual_image(rgb_image: np.ndarray, thermal_image: np.ndarray, file_name: str, rgb_pos: tuple[int,int] = (0,0), thermal_pos: tuple[int,int] = (0,0), header:dict=STD_HEADER):
+def write_dual_image(rgb_image: np.ndarray, thermal_image: np.ndarray, file_name: str, rgb_pos: tuple[int,int] = (0,0), thermal_pos: tuple[int,int] = (0,0), header:dict=STD_HEADER,
+                     visible_format: str = "float", visible_downscale: int = 1, thermal_format: str = "float", thermal_quantization: tuple[float,float] = THERMAL_QUANTIZATION,
+                     visible_compression: Optional[str] = None, thermal_compression: Optional[str] = None, visible_time: Optional[float] = None, thermal_time: Optional[float] = None, camera: Optional[str] = None):
+    rgb_image = encode_visible(rgb_image, visible_format, visible_downscale)
+    thermal_image, thermal_attributes = encode_thermal(thermal_image, thermal_format, thermal_quantization)
+
     # Change from (y,x,w) to (x,y)
     ris = rgb_image.shape[0:2][::-1]
     tis = thermal_image.shape[0:2][::-1]
@@ -32,24 +129,62 @@ def write_dual_image(rgb_image: np.ndarray, thermal_image: np.ndarray, file_name
         v2i_max(v2i_add(ris,rgb_pos,(-1,-1)), v2i_add(tis,thermal_pos,(-1,-1))) # Bottom right
     )
 
+    if camera:
+        header = header | {"cameraId": camera}
+
     rgb_header = header.copy()
     rgb_header["name"] = "visible"
     rgb_header["view"] = "visible"
     rgb_header["displayWindow"] = full_display
+    if visible_compression:
+        rgb_header["compression"] = compression(visible_compression, rgb_image.dtype)
+    if visible_time is not None:
+        rgb_header["captureTime"] = capture_time_attribute(visible_time)
     rgb_header["dataWindow"] = (rgb_pos, v2i_add(rgb_pos,ris,(-1,-1)))
     rgb_part = OpenEXR.Part(rgb_header, {"RGB": rgb_image})
 
     thermal_header = header.copy()
+    thermal_header.update(thermal_attributes)
     thermal_header["name"] = "infrared"
     thermal_header["view"] = "infrared"
     thermal_header["displayWindow"] = full_display
+    if thermal_compression:
+        thermal_header["compression"] = compression(thermal_compression, thermal_image.dtype)
+    if thermal_time is not None:
+        thermal_header["captureTime"] = capture_time_attribute(thermal_time)
     thermal_header["dataWindow"] = (thermal_pos, v2i_add(thermal_pos,tis,(-1,-1)))
     thermal_part = OpenEXR.Part(thermal_header, {"T": thermal_image})
 
     with OpenEXR.File([rgb_part, thermal_part]) as outfile:
         outfile.write(file_name)
 
-def read_dual_image(file_name: str) -> tuple[np.ndarray, np.ndarray]:
+'''Only the visible part, for containers that store the thermal image elsewhere.'''
+def write_visible_image(rgb_image: np.ndarray, file_name: str | BinaryIO, visible_format: str = "float", visible_downscale: int = 1, visible_compression: Optional[str] = None,
+                        visible_time: Optional[float] = None, camera: Optional[str] = None, header: dict = STD_HEADER):
+    rgb_image = encode_visible(rgb_image, visible_format, visible_downscale)
+    rgb_header = header.copy()
+    if camera:
+        rgb_header["cameraId"] = camera
+    rgb_header["name"] = "visible"
+    rgb_header["view"] = "visible"
+    if visible_compression:
+        rgb_header["compression"] = compression(visible_compression, rgb_image.dtype)
+    if visible_time is not None:
+        rgb_header["captureTime"] = capture_time_attribute(visible_time)
+    with OpenEXR.File(rgb_header, {"RGB": rgb_image}) as outfile:
+        outfile.write(file_name)
+
+def read_visible_image(file_name: str | BinaryIO) -> np.ndarray:
+    with OpenEXR.File(file_name) as infile:
+        return decode_visible(infile.channels()["RGB"].pixels)
+
+def header_quantization(header: dict) -> Optional[tuple[float,float]]:
+    if "thermalScale" in header and "thermalOffset" in header:
+        return header["thermalScale"], header["thermalOffset"]
+    return None
+
+# file_name can also be a seekable binary stream
+def read_dual_image(file_name: str | BinaryIO) -> tuple[np.ndarray, np.ndarray]:
     with OpenEXR.File(file_name) as infile:
         rgb_part = -1
         thermal_part = -1
@@ -58,4 +193,213 @@ def read_dual_image(file_name: str) -> tuple[np.ndarray, np.ndarray]:
                 rgb_part = part.part_index
             elif part.name() == "infrared":
                 thermal_part = part.part_index
-        return infile.channels(rgb_part)["RGB"].pixels, infile.channels(thermal_part)["T"].pixels
\ No newline at end of file
+        rgb = decode_visible(infile.channels(rgb_part)["RGB"].pixels)
+        thermal = decode_thermal(infile.channels(thermal_part)["T"].pixels, header_quantization(infile.parts[thermal_part].header))
+        return rgb, thermal
+
+# Selective reads
+# OpenEXR.File always decodes every part, these functions parse the file directly and only decode the chunks of
+# the requested parts and scanlines. Compressions other than NONE, RLE, ZIPS and ZIP fall back to OpenEXR.File.
+
+EXR_MAGIC = b"\x76\x2f\x31\x01"
+EXR_TILED = 0x200
+EXR_MULTIPART = 0x1000
+PIXEL_TYPES = {0: np.dtype("<u4"), 1: np.dtype("<f2"), 2: np.dtype("<f4")}
+LINES_PER_CHUNK = {0: 1, 1: 1, 2: 1, 3: 16, 4: 32, 5: 16, 6: 32, 7: 32, 8: 32, 9: 256}
+DIRECT_COMPRESSIONS = {0, 1, 2, 3} # NONE, RLE, ZIPS, ZIP
+
+def _float_attribute(type_name: str, data: bytes) -> float:
+    return struct.unpack("<d" if type_name == "double" else "<f", data)[0]
+
+class PartInfo:
+    def __init__(self, index: int, attributes: dict[str, tuple[str, bytes]]):
+        self.index = index
+        self.name = attributes["name"][1].decode() if "name" in attributes else ""
+        self.type = attributes["type"][1].decode() if "type" in attributes else "scanlineimage"
+        self.compression = attributes["compression"][1][0]
+        xmin, ymin, xmax, ymax = struct.unpack("<4i", attributes["dataWindow"][1])
+        self.origin = (xmin, ymin)
+        self.width = xmax - xmin + 1
+        self.height = ymax - ymin + 1
+        self.lines_per_chunk = LINES_PER_CHUNK.get(self.compression, 1)
+        self.chunk_count = struct.unpack("<i", attributes["chunkCount"][1])[0] if "chunkCount" in attributes else -(-self.height // self.lines_per_chunk)
+        self.channels: list[tuple[str, np.dtype]] = []
+        self.subsampled = False
+        data = attributes["channels"][1]
+        pos = 0
+        while data[pos] != 0:
+            end = data.index(b"\0", pos)
+            pixel_type, _, xs, ys = struct.unpack_from("<iB3xii", data, end+1)
+            self.channels.append((data[pos:end].decode(), PIXEL_TYPES[pixel_type]))
+            self.subsampled |= xs != 1 or ys != 1
+            pos = end + 17
+        self.offsets = np.zeros(self.chunk_count, dtype=np.uint64)
+        self.quantization = None
+        self.capture_time = float(attributes["captureTime"][1]) if "captureTime" in attributes else None
+        if "thermalScale" in attributes and "thermalOffset" in attributes:
+            self.quantization = (_float_attribute(*attributes["thermalScale"]), _float_attribute(*attributes["thermalOffset"]))
+
+    def decode(self, pixels: np.ndarray) -> np.ndarray:
+        '''Quantized thermal and UINT visible pixels to float32, float and half pixels unchanged.'''
+        if self.quantization:
+            return decode_thermal(pixels, self.quantization)
+        if pixels.dtype == np.uint32:
+            return decode_visible(pixels)
+        return pixels
+
+    @property
+    def direct(self) -> bool:
+        return self.compression in DIRECT_COMPRESSIONS and self.type == "scanlineimage" and not self.subsampled
+
+    def line_dtype(self) -> np.dtype:
+        return np.dtype([(name, dtype, (self.width,)) for name, dtype in self.channels])
+
+def _open(file_name: str | BinaryIO):
+    if isinstance(file_name, (str, os.PathLike)):
+        return open(file_name, "rb")
+    file_name.seek(0)
+    return contextlib.nullcontext(file_name)
+
+def _read_cstr(f: BinaryIO) -> bytes:
+    out = b""
+    while (c := f.read(1)) not in (b"\0", b""):
+        out += c
+    return out
+
+def read_headers(f: BinaryIO) -> tuple[list[PartInfo], bool]:
+    if f.read(4) != EXR_MAGIC:
+        raise ValueError("Not an OpenEXR file")
+    flags = struct.unpack("<I", f.read(4))[0]
+    multipart = bool(flags & EXR_MULTIPART)
+    parts = []
+    while True:
+        attributes = {}
+        while name := _read_cstr(f):
+            type_name = _read_cstr(f)
+            size = struct.unpack("<i", f.read(4))[0]
+            attributes[name.decode()] = (type_name.decode(), f.read(size))
+        if not attributes:
+            break # Empty header ends the multi-part header list
+        part = PartInfo(len(parts), attributes)
+        if flags & EXR_TILED:
+            part.type = "tiledimage"
+        parts.append(part)
+        if not multipart:
+            break
+    for part in parts:
+        part.offsets = np.frombuffer(f.read(8*part.chunk_count), dtype="<u8")
+    return parts, multipart
+
+def _predictor_deinterleave(data: bytes) -> np.ndarray:
+    t = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    t[1:] -= 128
+    t = (np.cumsum(t) & 0xFF).astype(np.uint8)
+    out = np.empty_like(t)
+    half = (len(t)+1)//2
+    out[0::2] = t[:half]
+    out[1::2] = t[half:]
+    return out
+
+def _rle_decode(data: bytes) -> bytes:
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        count = struct.unpack_from("<b", data, pos)[0]
+        pos += 1
+        if count < 0:
+            out += data[pos:pos-count]
+            pos -= count
+        else:
+            out += data[pos:pos+1] * (count+1)
+            pos += 1
+    return bytes(out)
+
+def _read_chunk(f: BinaryIO, part: PartInfo, multipart: bool, chunk: int) -> np.ndarray:
+    f.seek(int(part.offsets[chunk]))
+    if multipart:
+        f.read(4) # Part number
+    y, size = struct.unpack("<ii", f.read(8))
+    data = f.read(size)
+    lines = min(part.lines_per_chunk, part.origin[1]+part.height-y)
+    line_dtype = part.line_dtype()
+    expected = lines * line_dtype.itemsize
+    if size < expected:
+        if part.compression == 1:
+            data = _predictor_deinterleave(_rle_decode(data))
+        elif part.compression in (2, 3):
+            data = _predictor_deinterleave(zlib.decompress(data))
+    return np.frombuffer(data, dtype=line_dtype, count=lines)
+
+def _assemble(part: PartInfo, lines: np.ndarray) -> np.ndarray:
+    names = [i[0] for i in part.channels]
+    if len(names) == 1:
+        return lines[names[0]]
+    if set(names) <= set("RGBA"):
+        names = [i for i in "RGBA" if i in names]
+    return np.stack([lines[i] for i in names], axis=-1)
+
+def _find_part(parts: list[PartInfo], name: str) -> PartInfo:
+    for part in parts:
+        if part.name == name:
+            return part
+    raise KeyError(f"No part named {name}")
+
+def _read_fallback(f: BinaryIO, name: str) -> np.ndarray:
+    f.seek(0)
+    with OpenEXR.File(f) as infile:
+        for part in infile.parts:
+            if part.name() == name:
+                channels = infile.channels(part.part_index)
+                return next(iter(channels.values())).pixels
+    raise KeyError(f"No part named {name}")
+
+'''
+rows: (first, stop) scanline band relative to the top of the data window
+Returns half parts in the stored precision, quantized and UINT parts are decoded to float32.
+'''
+def read_parts(file_name: str | BinaryIO, names: tuple[str, ...] = ("visible", "infrared"), rows: Optional[tuple[int,int]] = None) -> dict[str, np.ndarray]:
+    out = {}
+    with _open(file_name) as f:
+        parts, multipart = read_headers(f)
+        for name in names:
+            part = _find_part(parts, name)
+            first, stop = rows if rows else (0, part.height)
+            first, stop = max(first, 0), min(stop, part.height)
+            if not part.direct:
+                out[name] = part.decode(_read_fallback(f, name)[first:stop])
+                continue
+            lpc = part.lines_per_chunk
+            chunks = [_read_chunk(f, part, multipart, i) for i in range(first//lpc, -(-stop//lpc))]
+            lines = np.concatenate(chunks) if len(chunks) != 1 else chunks[0]
+            out[name] = part.decode(_assemble(part, lines[first - (first//lpc)*lpc:][:stop-first]))
+    return out
+
+def read_capture_times(file_name: str | BinaryIO) -> dict[str, Optional[float]]:
+    '''captureTime of every part in ms, only the header is read.'''
+    with _open(file_name) as f:
+        return {part.name: part.capture_time for part in read_headers(f)[0]}
+
+def read_thermal(file_name: str | BinaryIO, rows: Optional[tuple[int,int]] = None) -> np.ndarray:
+    return read_parts(file_name, ("infrared",), rows)["infrared"]
+
+'''
+points: (n,2) array of (x,y) positions
+Only the chunks containing the points are decoded.
+'''
+def read_pixels(file_name: str | BinaryIO, points: np.ndarray, name: str = "infrared") -> np.ndarray:
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    with _open(file_name) as f:
+        parts, multipart = read_headers(f)
+        part = _find_part(parts, name)
+        if not part.direct:
+            return part.decode(_read_fallback(f, name)[points[:,1], points[:,0]])
+        lpc = part.lines_per_chunk
+        chunk_ids = points[:,1] // lpc
+        out = np.empty((0,), dtype=part.channels[0][1])
+        for chunk in np.unique(chunk_ids):
+            pixels = _assemble(part, _read_chunk(f, part, multipart, int(chunk)))
+            mask = chunk_ids == chunk
+            if len(out) != len(points):
+                out = np.empty((len(points),) + pixels.shape[2:], dtype=pixels.dtype)
+            out[mask] = pixels[points[mask,1] - chunk*lpc, points[mask,0]]
+        return part.decode(out)
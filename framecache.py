@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
+
+import numpy as np
+
+Frame = tuple[np.ndarray, ...]
+
+def frame_nbytes(frame: Frame) -> int:
+    return sum(i.nbytes for i in frame if isinstance(i, np.ndarray))
+
+class FrameCache:
+    '''
+    LRU cache of decoded frames with read-ahead in the play direction.
+    load(index) decodes a single frame; it is called from worker threads.
+    '''
+    def __init__(self, load: Callable[[int], Frame], length: int, budget_mb: float = 512, ahead: int = 8, behind: int = 3, workers: int = 2):
+        self.load = load
+        self.length = length
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.ahead = ahead
+        self.behind = behind
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0 # Requested frame was still being prefetched
+        self.cancelled = 0
+        self.evicted = 0
+
+        self._frames: OrderedDict[int, Frame] = OrderedDict()
+        self._nbytes = 0
+        self._pending: dict[int, Future] = {}
+        self._wanted: set[int] = set()
+        self._current = -1
+        self._lock = threading.RLock() # Done callbacks can run inline from prefetch()
+        self._executor = ThreadPoolExecutor(max(workers, 1), thread_name_prefix="prefetch")
+
+    def _store(self, index: int, frame: Frame):
+        # Caller holds the lock
+        if index in self._frames:
+            return
+        self._frames[index] = frame
+        self._nbytes += frame_nbytes(frame)
+        while self._nbytes > self.budget and len(self._frames) > 1:
+            old = next(iter(self._frames))
+            if old == self._current:
+                self._frames.move_to_end(old)
+                old = next(iter(self._frames))
+            self._nbytes -= frame_nbytes(self._frames.pop(old))
+            self.evicted += 1
+
+    def _prefetched(self, index: int, future: Future):
+        with self._lock:
+            if self._pending.get(index) is future:
+                del self._pending[index]
+            if future.cancelled() or future.exception() is not None:
+                return
+            if index in self._wanted or index == self._current:
+                self._store(index, future.result())
+
+    def get(self, index: int) -> Frame:
+        with self._lock:
+            self._current = index
+            if index in self._frames:
+                self.hits += 1
+                self._frames.move_to_end(index)
+                return self._frames[index]
+            future = self._pending.get(index)
+
+        if future is not None and not future.cancelled():
+            self.waits += 1
+            try:
+                frame = future.result()
+            except Exception:
+                frame = None
+            if frame is not None:
+                with self._lock:
+                    self._store(index, frame)
+                return frame
+
+        self.misses += 1
+        frame = self.load(index)
+        with self._lock:
+            self._store(index, frame)
+        return frame
+
+    def prefetch(self, index: int, direction: int = 1, step: int = 1):
+        direction = 1 if direction >= 0 else -1
+        step = max(abs(step), 1) # Stride when playback skips frames
+        order = [index + direction*step*i for i in range(1, self.ahead+1)] + [index - direction*i for i in range(1, self.behind+1)]
+        order = [i for i in order if 0 <= i < self.length]
+
+        with self._lock:
+            self._wanted = set(order)
+            # Stale prefetches from before a jump
+            for i, future in list(self._pending.items()):
+                if i not in self._wanted and future.cancel():
+                    self._pending.pop(i, None)
+                    self.cancelled += 1
+            for i in order:
+                if i in self._frames or i in self._pending:
+                    continue
+                future = self._executor.submit(self.load, i)
+                self._pending[i] = future
+                future.add_done_callback(lambda f, i=i: self._prefetched(i, f))
+
+    def clear(self):
+        with self._lock:
+            for future in list(self._pending.values()):
+                future.cancel()
+            self._pending.clear()
+            self._wanted.clear()
+            self._frames.clear()
+            self._nbytes = 0
+
+    def close(self):
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses + self.waits
+        rate = self.hits / total * 100 if total else 0.0
+        return f"hits {self.hits}, waits {self.waits}, misses {self.misses} ({rate:.1f}% hit), cancelled {self.cancelled}, evicted {self.evicted}, {len(self._frames)} frames / {self._nbytes/1024/1024:.1f} MB"
@@ -0,0 +1,184 @@
+import os
+import copy
+from pathlib import Path
+from typing import BinaryIO, Optional, Self
+
+import numpy as np
+
+import exrutils
+
+SIDECAR_NAME = ".frameindex.npz"
+
+def parse_names(names: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    # Frames are named <ms>:<frame>.exr, unparsable names get -1
+    timestamps = np.full(len(names), -1, dtype=np.int64)
+    frame_numbers = np.full(len(names), -1, dtype=np.int64)
+    for i, name in enumerate(names):
+        try:
+            timestamp, frame_number = os.path.basename(name).removesuffix(".exr").split(":")
+            timestamps[i] = int(timestamp)
+            frame_numbers[i] = int(frame_number)
+        except ValueError:
+            pass
+    return timestamps, frame_numbers
+
+class FrameIndex:
+    '''
+    Sorted list of the frames in a directory, usable as a list of paths.
+    The names, timestamps and frame numbers are cached in a sidecar file and only new frames are parsed.
+    '''
+    def __init__(self, directory: Path, names: np.ndarray, timestamps: np.ndarray, frame_numbers: np.ndarray, mtime_ns: int = 0, live: bool = True):
+        self.directory = Path(directory)
+        self.names = names
+        self.timestamps = timestamps
+        self.frame_numbers = frame_numbers
+        self.mtime_ns = mtime_ns
+        self.live = live # Slices are fixed ranges and are not updated
+        self._frame_order: Optional[np.ndarray] = None
+        self._sorted_frame_numbers: Optional[np.ndarray] = None
+
+    @classmethod
+    def empty(cls, directory: Optional[Path] = None) -> Self:
+        '''No frames, updated from directory if one is given.'''
+        return cls(directory or Path("."), np.array([], dtype=str), np.array([], dtype=np.int64), np.array([], dtype=np.int64), live=directory is not None)
+
+    @classmethod
+    def open(cls, directory: str | Path) -> Self:
+        directory = Path(directory).resolve()
+        index = cls.load(directory) or cls.empty(directory)
+        index.update()
+        return index
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional[Self]:
+        try:
+            with np.load(directory / SIDECAR_NAME) as data:
+                return cls(directory, data["names"], data["timestamps"], data["frame_numbers"], int(data["mtime_ns"]))
+        except Exception:
+            return None # Missing or broken sidecars are rebuilt
+
+    @classmethod
+    def from_paths(cls, paths: list[str]) -> Self:
+        if not paths:
+            return cls.empty()
+        directory = Path(os.path.commonpath([os.path.dirname(os.path.abspath(i)) for i in paths]))
+        names = sorted(os.path.relpath(os.path.abspath(i), directory) for i in paths)
+        return cls(directory, np.array(names, dtype=str), *parse_names(names), live=False)
+
+    def save(self):
+        # Overwritten in place, creating or renaming a file would change the directory mtime
+        try:
+            with open(self.directory / SIDECAR_NAME, "wb") as f:
+                np.savez(f, names=self.names, timestamps=self.timestamps, frame_numbers=self.frame_numbers, mtime_ns=self.mtime_ns)
+        except OSError:
+            pass # Read only directories just don't get a sidecar
+
+    def update(self) -> int:
+        '''Rescans the directory if it changed, returns the number of new frames.'''
+        if not self.live:
+            return 0
+        try:
+            (self.directory / SIDECAR_NAME).touch()
+        except OSError:
+            pass
+        mtime_ns = os.stat(self.directory).st_mtime_ns
+        if mtime_ns == self.mtime_ns:
+            return 0
+
+        with os.scandir(self.directory) as it:
+            on_disk = [i.name for i in it if i.name.endswith(".exr") and i.is_file()]
+        known = set(self.names.tolist())
+        new = sorted(set(on_disk) - known)
+
+        if len(known) + len(new) != len(on_disk):
+            # Frames were removed, start over
+            names = sorted(on_disk)
+            self.names = np.array(names, dtype=str)
+            self.timestamps, self.frame_numbers = parse_names(names)
+            added = len(names)
+        else:
+            timestamps, frame_numbers = parse_names(new)
+            names = np.concatenate([self.names, np.array(new, dtype=str)])
+            order = np.argsort(names, kind="stable")
+            self.names = names[order]
+            self.timestamps = np.concatenate([self.timestamps, timestamps])[order]
+            self.frame_numbers = np.concatenate([self.frame_numbers, frame_numbers])[order]
+            added = len(new)
+
+        self.mtime_ns = mtime_ns
+        self._frame_order = None
+        self._sorted_frame_numbers = None
+        self.save()
+        return added
+
+    @property
+    def valid(self) -> bool:
+        '''All frame names could be parsed.'''
+        return bool((self.timestamps >= 0).all())
+
+    def path(self, i: int) -> str:
+        return str(self.directory / str(self.names[i]))
+
+    def find_name(self, name: str) -> int:
+        i = int(np.searchsorted(self.names, name))
+        if i < len(self.names) and self.names[i] == name:
+            return i
+        return -1
+
+    def find_timestamp(self, timestamp: int) -> int:
+        '''Index of the last frame recorded at or before timestamp (ms).'''
+        return max(int(np.searchsorted(self.timestamps, timestamp, side="right")) - 1, 0)
+
+    def find_frame(self, frame_number: int) -> int:
+        '''Index of the first frame with the given number or -1. Frame numbers restart with every recording.'''
+        if self._frame_order is None:
+            self._frame_order = np.argsort(self.frame_numbers, kind="stable")
+            self._sorted_frame_numbers = self.frame_numbers[self._frame_order]
+        i = int(np.searchsorted(self._sorted_frame_numbers, frame_number))
+        if i < len(self._frame_order) and self._sorted_frame_numbers[i] == frame_number:
+            return int(self._frame_order[i])
+        return -1
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def source(self, i: int) -> str | BinaryIO:
+        '''Path or stream that the exrutils readers accept.'''
+        return self.path(i)
+
+    def read_dual_image(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        return exrutils.read_dual_image(self.source(i))
+
+    def read_thermal(self, i: int, rows: Optional[tuple[int,int]] = None) -> np.ndarray:
+        return exrutils.read_thermal(self.source(i), rows)
+
+    def read_pixels(self, i: int, points: np.ndarray) -> np.ndarray:
+        return exrutils.read_pixels(self.source(i), points)
+
+    def read_capture_times(self, i: int) -> dict[str, Optional[float]]:
+        return exrutils.read_capture_times(self.source(i))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            view = copy.copy(self)
+            view.names = self.names[key]
+            view.timestamps = self.timestamps[key]
+            view.frame_numbers = self.frame_numbers[key]
+            view.live = False
+            view._frame_order = None
+            view._sorted_frame_numbers = None
+            return view
+        return self.path(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.path(i)
+
+    def close(self):
+        '''Releases open files, slices share them. Plain directories hold none.'''
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
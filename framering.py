@@ -0,0 +1,142 @@
+import os
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Callable, Optional
+
+import numpy as np
+
+import exrutils
+
+POLICIES = ["block", "drop_oldest", "drop_newest"]
+
+def _slot_views(buf, slot: int, slot_size: int, rgb_capacity: int, rgb_shape: tuple, rgb_dtype: np.dtype, thermal_shape: tuple, thermal_dtype: np.dtype) -> tuple[np.ndarray, np.ndarray]:
+    offset = slot * slot_size
+    rgb = np.ndarray(rgb_shape, dtype=rgb_dtype, buffer=buf, offset=offset)
+    thermal = np.ndarray(thermal_shape, dtype=thermal_dtype, buffer=buf, offset=offset + rgb_capacity)
+    return rgb, thermal
+
+def _writer(shm_name: str, layout: tuple, ready: mp.Queue, free: mp.Queue, queued, written, latency_sum, latency_last, write: Callable):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slot_size, rgb_capacity, rgb_dtype, thermal_dtype = layout
+    try:
+        while (item := ready.get()) is not None:
+            slot, file_name, rgb_shape, thermal_shape, enqueued, options = item
+            with queued.get_lock():
+                queued.value -= 1
+            rgb, thermal = _slot_views(shm.buf, slot, slot_size, rgb_capacity, rgb_shape, rgb_dtype, thermal_shape, thermal_dtype)
+            try:
+                write(rgb, thermal, file_name, **options)
+            except Exception as e:
+                print(f"Failed to write {file_name}: {e}")
+            del rgb, thermal # The views must go before the shared memory can be closed
+            free.put(slot)
+            latency = time.monotonic() - enqueued
+            with written.get_lock():
+                written.value += 1
+                latency_sum.value += latency
+                latency_last.value = latency
+    finally:
+        shm.close()
+
+class FrameRing:
+    '''
+    Fixed number of shared memory frame slots that writer processes encode from without copying.
+    The producer copies each frame into a free slot once; when all slots are in use the policy decides:
+    "block" waits for a writer, "drop_oldest" reuses the oldest queued frame, "drop_newest" drops the new frame.
+    Slots are sized for the first frame, a frame that does not fit restarts the ring after the queued frames are written.
+    '''
+    def __init__(self, slots: int = 32, writers: int = 0, policy: str = "block", write: Callable = exrutils.write_dual_image):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy}, use one of {POLICIES}")
+        self.slots = slots
+        self.writers = writers if writers > 0 else os.cpu_count()
+        self.policy = policy
+        self.write = write
+
+        self.dropped = 0
+        self.queued = mp.Value("i", 0)
+        self.written = mp.Value("q", 0)
+        self.latency_sum = mp.Value("d", 0.0)
+        self.latency_last = mp.Value("d", 0.0)
+
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.processes: list[mp.Process] = []
+
+    def _start(self, rgb: np.ndarray, thermal: np.ndarray):
+        rgb_capacity = -(-rgb.nbytes // 64) * 64 # Keep the thermal part aligned
+        self.layout = (rgb_capacity + thermal.nbytes, rgb_capacity, rgb.dtype, thermal.dtype)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.layout[0] * self.slots)
+        self.ready = mp.Queue()
+        self.free = mp.Queue()
+        for i in range(self.slots):
+            self.free.put(i)
+        for _ in range(self.writers):
+            p = mp.Process(target=_writer, args=(self.shm.name, self.layout, self.ready, self.free, self.queued, self.written, self.latency_sum, self.latency_last, self.write), daemon=True)
+            p.start()
+            self.processes.append(p)
+
+    def _acquire(self) -> Optional[int]:
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            pass
+        if self.policy == "drop_newest":
+            return None
+        if self.policy == "drop_oldest":
+            try:
+                slot = self.ready.get_nowait()[0]
+                with self.queued.get_lock():
+                    self.queued.value -= 1
+                self.dropped += 1
+                return slot
+            except queue.Empty:
+                pass # A writer took it, its slot comes back soon
+        return self.free.get()
+
+    def put(self, rgb: np.ndarray, thermal: np.ndarray, file_name: str, **options) -> bool:
+        '''Queues a frame for writing, options are passed on to write. Returns False if the frame was dropped.'''
+        if self.shm is not None:
+            slot_size, rgb_capacity, rgb_dtype, thermal_dtype = self.layout
+            if rgb.nbytes > rgb_capacity or thermal.nbytes > slot_size - rgb_capacity or rgb.dtype != rgb_dtype or thermal.dtype != thermal_dtype:
+                self.close()
+        if self.shm is None:
+            self._start(rgb, thermal)
+        slot_size, rgb_capacity, rgb_dtype, thermal_dtype = self.layout
+
+        slot = self._acquire()
+        if slot is None:
+            self.dropped += 1
+            return False
+        rgb_view, thermal_view = _slot_views(self.shm.buf, slot, slot_size, rgb_capacity, rgb.shape, rgb_dtype, thermal.shape, thermal_dtype)
+        np.copyto(rgb_view, rgb)
+        np.copyto(thermal_view, thermal)
+        del rgb_view, thermal_view
+        with self.queued.get_lock():
+            self.queued.value += 1
+        self.ready.put((slot, file_name, rgb.shape, thermal.shape, time.monotonic(), options))
+        return True
+
+    @property
+    def depth(self) -> int:
+        return self.queued.value
+
+    # Latency is measured from put() until the frame is on disk
+    def stats(self) -> str:
+        written = self.written.value
+        mean = self.latency_sum.value / written * 1000 if written else 0.0
+        return f"queue {self.depth}/{self.slots}, written {written}, latency {self.latency_last.value*1000:.1f} ms (mean {mean:.1f} ms), dropped {self.dropped}"
+
+    def close(self):
+        '''Waits for the queued frames to be written.'''
+        if self.shm is None:
+            return
+        for _ in self.processes:
+            self.ready.put(None)
+        for p in self.processes:
+            p.join()
+        self.processes = []
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
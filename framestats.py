@@ -0,0 +1,154 @@
+import os
+import struct
+import argparse
+from pathlib import Path
+from typing import Optional, Self
+
+import numpy as np
+
+from frameindex import FrameIndex
+from parallel import ordered_map
+from config import config
+
+STATS_NAME = ".framestats"
+MAGIC = b"THSTATS\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIff") # magic, version, histogram bins, histogram min, histogram max
+HEADER_SIZE = 64
+
+'''
+Per-frame statistics of a recording, stored as fixed size records after a 64 byte header so the table can be
+memory mapped and appended to while recording. argmin and argmax are flat indices into the (y,x) thermal image.
+'''
+def record_dtype(bins: int) -> np.dtype:
+    return np.dtype([
+        ("timestamp", "<i8"),
+        ("frame", "<i8"),
+        ("min", "<f4"),
+        ("max", "<f4"),
+        ("mean", "<f4"),
+        ("argmin", "<i4"),
+        ("argmax", "<i4"),
+        ("hist", "<u4", (bins,)),
+    ])
+
+def pack_header(bins: int, hist_min: float, hist_max: float) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, bins, hist_min, hist_max).ljust(HEADER_SIZE, b"\0")
+
+def histogram_params() -> tuple[int, float, float]:
+    return config["stats"].getint("bins"), config["stats"].getfloat("hist_min"), config["stats"].getfloat("hist_max")
+
+def compute(timestamp: int, frame: int, thermal: np.ndarray, bins: int, hist_min: float, hist_max: float) -> np.ndarray:
+    flat = thermal.reshape(-1)
+    record = np.zeros(1, dtype=record_dtype(bins))
+    record["timestamp"] = timestamp
+    record["frame"] = frame
+    record["argmin"] = flat.argmin()
+    record["argmax"] = flat.argmax()
+    record["min"] = flat[record["argmin"][0]]
+    record["max"] = flat[record["argmax"][0]]
+    record["mean"] = flat.mean(dtype=np.float64)
+    # Values outside of the histogram range land in the edge bins
+    bin_index = np.clip(((flat - hist_min) * (bins / (hist_max - hist_min))).astype(np.int64), 0, bins-1)
+    record["hist"][0] = np.bincount(bin_index, minlength=bins)
+    return record
+
+class FrameStats:
+    def __init__(self, path: Path, bins: int, hist_min: float, hist_max: float, records: np.ndarray):
+        self.path = path
+        self.bins = bins
+        self.hist_min = hist_min
+        self.hist_max = hist_max
+        self.records = records
+
+    @classmethod
+    def open(cls, directory: str | Path) -> Optional[Self]:
+        path = Path(directory) / STATS_NAME
+        try:
+            with open(path, "rb") as f:
+                magic, version, bins, hist_min, hist_max = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                return None
+            dtype = record_dtype(bins)
+            count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+            if count <= 0:
+                return cls(path, bins, hist_min, hist_max, np.zeros(0, dtype=dtype))
+            return cls(path, bins, hist_min, hist_max, np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,)))
+        except (OSError, struct.error):
+            return None
+
+    def hist_edges(self) -> np.ndarray:
+        return np.linspace(self.hist_min, self.hist_max, self.bins+1)
+
+    def lookup(self, files: FrameIndex) -> Optional[np.ndarray]:
+        '''Records matching every frame of files, None if some frames are missing from the table.'''
+        if len(files) == 0 or len(self.records) == 0:
+            return None
+        pos = np.searchsorted(self.records["timestamp"], files.timestamps)
+        pos = np.minimum(pos, len(self.records)-1)
+        rows = np.asarray(self.records[pos])
+        if not (np.array_equal(rows["timestamp"], files.timestamps) and np.array_equal(rows["frame"], files.frame_numbers)):
+            return None
+        return rows
+
+class FrameStatsWriter:
+    '''Appends records while recording, reuses the histogram parameters of an existing table.'''
+    def __init__(self, directory: str | Path):
+        os.makedirs(directory, exist_ok=True)
+        path = Path(directory) / STATS_NAME
+        existing = FrameStats.open(directory)
+        if existing:
+            self.bins, self.hist_min, self.hist_max = existing.bins, existing.hist_min, existing.hist_max
+            self.file = open(path, "ab")
+        else:
+            self.bins, self.hist_min, self.hist_max = histogram_params()
+            self.file = open(path, "wb")
+            self.file.write(pack_header(self.bins, self.hist_min, self.hist_max))
+
+    def append(self, timestamp: int, frame: int, thermal: np.ndarray):
+        self.file.write(compute(timestamp, frame, thermal, self.bins, self.hist_min, self.hist_max).tobytes())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def write_table(directory: Path, records: np.ndarray, bins: int, hist_min: float, hist_max: float):
+    with open(directory / STATS_NAME, "wb") as f:
+        f.write(pack_header(bins, hist_min, hist_max))
+        f.write(records.tobytes())
+
+def compute_chunk(files: FrameIndex, bins: int, hist_min: float, hist_max: float) -> np.ndarray:
+    return np.concatenate([compute(files.timestamps[i], files.frame_numbers[i], files.read_thermal(i), bins, hist_min, hist_max) for i in range(len(files))])
+
+def build(directory: str | Path, workers: int = 1, chunk_size: int = 64) -> int:
+    '''Computes the records of frames missing from the table, returns how many were added.'''
+    files = FrameIndex.open(directory)
+    existing = FrameStats.open(files.directory)
+    if existing:
+        bins, hist_min, hist_max = existing.bins, existing.hist_min, existing.hist_max
+        known = set(zip(existing.records["timestamp"].tolist(), existing.records["frame"].tolist()))
+        records = [np.array(existing.records)]
+    else:
+        bins, hist_min, hist_max = histogram_params()
+        known = set()
+        records = [np.zeros(0, dtype=record_dtype(bins))]
+
+    missing = [i for i in range(len(files)) if (int(files.timestamps[i]), int(files.frame_numbers[i])) not in known]
+    if not missing:
+        return 0
+    # Contiguous runs of missing frames, usually just the end of the recording
+    runs = np.split(np.array(missing), np.flatnonzero(np.diff(missing) != 1) + 1)
+    chunks = ((files[run[0]+i:run[0]+min(i+chunk_size, len(run))], bins, hist_min, hist_max) for run in runs for i in range(0, len(run), chunk_size))
+    records.extend(ordered_map(compute_chunk, chunks, workers))
+
+    records = np.concatenate(records)
+    records = records[np.lexsort((records["frame"], records["timestamp"]))]
+    write_table(files.directory, records, bins, hist_min, hist_max)
+    return len(missing)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Frame statistics", description="Builds or updates the per-frame statistics table of a recording")
+    parser.add_argument("path")
+    parser.add_argument("-j", "--workers", type=int, default=config["export"].getint("workers"), help="Worker processes, 0 uses every core")
+    args = parser.parse_args()
+    print(f"Added {build(args.path, args.workers if args.workers > 0 else os.cpu_count())} frames")
@@ -0,0 +1,133 @@
+import os
+import math
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from frameindex import FrameIndex
+
+'''
+Isotherm front tracking. The front is the outline of the largest region at or above the isotherm (below it with
+rising=False). After the first frame only a band of band pixels around the previous front is thresholded, pixels
+inside the band keep the side of the front they were on. When the front leaves the band or is lost the whole frame
+is searched again. All positions are (x,y) pixels, the position of the front is the radius of a circle of equal area.
+'''
+class Front:
+    def __init__(self, contour: Optional[np.ndarray], timestamp: float, velocity: float, full: bool):
+        self.contour = contour # (n,2) int32 (x,y), None if no pixel reached the isotherm
+        self.timestamp = timestamp # s
+        self.area = float(cv2.contourArea(contour)) if contour is not None else 0.0
+        self.radius = math.sqrt(self.area / math.pi)
+        self.velocity = velocity # Change of radius in px/s, nan on the first frame
+        self.full = full # The whole frame was searched
+        if contour is not None and self.area > 0:
+            m = cv2.moments(contour)
+            self.centroid = (m["m10"] / m["m00"], m["m01"] / m["m00"])
+        else:
+            self.centroid = (math.nan, math.nan)
+
+    def __str__(self) -> str:
+        return f"front r {self.radius:.1f} px, v {self.velocity:+.1f} px/s" + (" (full search)" if self.full else "")
+
+class FrontTracker:
+    def __init__(self, isotherm: float, band: int = 8, rising: bool = True):
+        self.isotherm = isotherm
+        self.band = band
+        self.rising = rising
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2*band+1, 2*band+1)) # Separable, much faster than an ellipse
+        self.reset()
+
+    def reset(self):
+        '''Forgets the front, the next frame is searched completely. Call it after seeking.'''
+        self.front: Optional[Front] = None
+        self.shape: Optional[tuple[int,int]] = None
+        self.lost = False # The front left the band, the next update needs the whole frame
+        self.mask: Optional[np.ndarray] = None # 255 inside the front
+
+    def _hot(self, thermal: np.ndarray) -> np.ndarray:
+        '''255 where thermal is on the hot side of the isotherm.'''
+        return cv2.compare(np.ascontiguousarray(thermal, dtype=np.float32), self.isotherm, cv2.CMP_GE if self.rising else cv2.CMP_LE)
+
+    def search_rows(self) -> Optional[tuple[int,int]]:
+        '''Rows the next update needs, None for the whole frame.'''
+        if self.front is None or self.front.contour is None or self.lost:
+            return None
+        y0 = int(self.front.contour[:,1].min()) - self.band - 1
+        y1 = int(self.front.contour[:,1].max()) + self.band + 2
+        return max(y0, 0), min(y1, self.shape[0])
+
+    def _largest(self, mask: np.ndarray, offset: tuple[int,int]) -> Optional[np.ndarray]:
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        if not contours:
+            return None
+        return max(contours, key=cv2.contourArea).reshape(-1, 2)
+
+    def _search_band(self, thermal: np.ndarray, row_offset: int) -> Optional[np.ndarray]:
+        contour = self.front.contour
+        h, w = self.shape
+        x0 = max(int(contour[:,0].min()) - self.band - 1, 0)
+        x1 = min(int(contour[:,0].max()) + self.band + 2, w)
+        y0, y1 = self.search_rows()
+
+        # Inside the band the new frame decides, everywhere else the previous front does
+        previous = self.mask[y0:y1, x0:x1]
+        band = cv2.morphologyEx(previous, cv2.MORPH_GRADIENT, self.kernel)
+        hot = self._hot(thermal[y0-row_offset:y1-row_offset, x0:x1])
+        mask = cv2.bitwise_or(cv2.bitwise_and(hot, band), cv2.bitwise_and(previous, cv2.bitwise_not(band)))
+        found = self._largest(mask, (x0, y0))
+        if found is None:
+            return None
+
+        # A front on the outer edge of the band may have moved further, pixels on the frame border are fine
+        edge = cv2.bitwise_and(band, cv2.bitwise_not(cv2.erode(band, None, borderType=cv2.BORDER_REPLICATE)))
+        px, py = found[:,0], found[:,1]
+        on_edge = (edge[py-y0, px-x0] != 0) & (px > 0) & (px < w-1) & (py > 0) & (py < h-1)
+        return None if on_edge.any() else found
+
+    def update(self, thermal: np.ndarray, timestamp: float, row_offset: int = 0, shape: Optional[tuple[int,int]] = None) -> Optional[Front]:
+        '''
+        thermal: (y,x) frame or just its search_rows() starting at row_offset, shape is then the full frame shape
+        timestamp: s
+        Returns None if the front left the band of a partial frame, update again with the whole frame.
+        '''
+        thermal = thermal.reshape(thermal.shape[0], thermal.shape[1])
+        shape = shape or thermal.shape
+        if self.shape != shape:
+            self.reset()
+            self.shape = shape
+        contour = None
+        full = self.search_rows() is None
+        if not full:
+            contour = self._search_band(thermal, row_offset)
+            full = contour is None
+        if full:
+            if thermal.shape != shape:
+                self.lost = True
+                return None
+            contour = self._largest(self._hot(thermal), (0, 0))
+            self.lost = False
+
+        self.mask = np.zeros(shape, dtype=np.uint8)
+        if contour is not None:
+            cv2.drawContours(self.mask, [contour], -1, 255, cv2.FILLED)
+        front = Front(contour, timestamp, math.nan, full)
+        if self.front is not None and timestamp != self.front.timestamp:
+            front.velocity = (front.radius - self.front.radius) / (timestamp - self.front.timestamp)
+        self.front = front
+        return front
+
+def track(files: FrameIndex, tracker: FrontTracker):
+    '''Yields the front of every frame, only the rows around the previous front are decoded.'''
+    for i in range(len(files)):
+        rows = tracker.search_rows()
+        timestamp = files.timestamps[i] / 1000.0
+        front = tracker.update(files.read_thermal(i, rows), timestamp, rows[0], tracker.shape) if rows else None
+        yield front or tracker.update(files.read_thermal(i), timestamp)
+
+def export_front(files: FrameIndex, outpath: str, isotherm: float, band: int = 8, rising: bool = True):
+    os.makedirs(os.path.dirname(outpath) or ".", exist_ok=True)
+    with open(outpath, "w") as f:
+        f.write("timestamp, frame, area, radius, velocity, centroid_x, centroid_y, full_search\n")
+        for i, front in enumerate(track(files, FrontTracker(isotherm, band, rising))):
+            f.write(f"{files.timestamps[i]}, {files.frame_numbers[i]}, {front.area}, {front.radius}, {front.velocity}, {front.centroid[0]}, {front.centroid[1]}, {int(front.full)}\n")
@@ -1,33 +1,22 @@
 import os
-import zipfile
-import tempfile
 from typing import Optional
 from pathlib import Path
-from glob import glob
-
-temp_handle: Optional[tempfile.TemporaryDirectory] = None
-
-def zip_range(file_name: str) -> list[str]:
-    global temp_handle
-    paths = []
-    temp_handle = tempfile.TemporaryDirectory()
-    temp_dir = temp_handle.name
-    with zipfile.ZipFile(file_name, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
-
-    for root, dirs, files in os.walk(temp_dir):
-        for file in files:
-            if file.endswith(".exr"):
-                paths.append(os.path.join(root, file))
-    
-    return sorted(paths)
 
-def file_range(start: str, end: Optional[str] = None) -> tuple[list[str], int]:
+from frameindex import FrameIndex
+from zipindex import ZipFrameIndex
+from thermalseq import SequenceFrameIndex, SUFFIX
+
+def zip_range(file_name: str) -> ZipFrameIndex:
+    return ZipFrameIndex(file_name)
+
+def file_range(start: str, end: Optional[str] = None) -> tuple[FrameIndex, int]:
     startpath = None
     if os.path.isfile(start):
         startpath = Path(start).resolve()
         if start.endswith(".zip"):
             return zip_range(start), 0
+        if start.endswith(SUFFIX):
+            return SequenceFrameIndex(start), 0
         dirpath = startpath.parent
 
     elif os.path.isdir(start):
@@ -36,25 +25,24 @@ def file_range(start: str, end: Optional[str] = None) -> tuple[list[str], int]:
     else:
         raise ValueError(f"{start} is not a valid path")
     
-    file_list = sorted(glob(str(dirpath / "*.exr")))
+    file_list = FrameIndex.open(dirpath)
 
     start_index = 0
     if startpath:
-        if str(startpath) in file_list:
-            start_index = file_list.index(str(startpath))
+        start_index = max(file_list.find_name(startpath.name), 0)
 
-    end_index = len(file_list)
     if end:
         if os.path.isfile(end):
             endpath = Path(end).resolve()
-            if str(endpath) in file_list:
-                end_index = file_list.index(str(endpath))
+            end_index = file_list.find_name(endpath.name) if endpath.parent == dirpath else -1
+            if end_index != -1:
+                return file_list[:end_index+1], start_index
 
         else:
             raise ValueError(f"{end} is not a valid *file* path")
     
-    return file_list[:end_index+1], start_index
+    return file_list, start_index
 
-def file_range_sharp_start(start: str, end: Optional[str] = None) -> list[str]:
+def file_range_sharp_start(start: str, end: Optional[str] = None) -> FrameIndex:
     paths, index = file_range(start, end)
     return paths[index:]
\ No newline at end of file
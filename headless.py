@@ -0,0 +1,111 @@
+import os
+import time
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+from typing import Optional
+
+from seekcamera import SeekCameraIOType, SeekCameraManager
+
+import exrutils
+from session import RecordingSession
+from config import config
+
+'''
+Recorder without a window, pygame is never imported.
+Control it with signals (SIGUSR1 starts, SIGUSR2 stops recording, SIGINT/SIGTERM quit) or through the control socket
+with one command per line: start, stop, status, quit. python headless.py --send <command> sends one.
+'''
+COMMANDS = ["start", "stop", "status", "quit"]
+
+class Control:
+    def __init__(self, recording: bool):
+        self.recording = threading.Event()
+        if recording:
+            self.recording.set()
+        self.quit = threading.Event()
+        self.session: Optional[RecordingSession] = None
+
+    def __call__(self, command: str) -> str:
+        if command == "start":
+            self.recording.set()
+        elif command == "stop":
+            self.recording.clear()
+        elif command == "quit":
+            self.quit.set()
+        elif command != "status":
+            return f"unknown command {command}, use one of {COMMANDS}"
+        return "\n".join([f"recording {self.recording.is_set()}"] + self.session.stats())
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(path: str, control: Control) -> ControlServer:
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                self.wfile.write((control(line.decode().strip()) + "\n\n").encode())
+    if os.path.exists(path):
+        os.remove(path) # Left behind by a recorder that did not shut down
+    server = ControlServer(path, Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def send(path: str, command: str) -> str:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((command + "\n").encode())
+        reply = b""
+        while not reply.endswith(b"\n\n") and (data := s.recv(4096)):
+            reply += data
+        return reply.decode().strip()
+
+def run(control: Control, socket_path: str, interval: float):
+    control.session = RecordingSession(control.recording.is_set)
+    signal.signal(signal.SIGUSR1, lambda *_: control.recording.set())
+    signal.signal(signal.SIGUSR2, lambda *_: control.recording.clear())
+    signal.signal(signal.SIGINT, lambda *_: control.quit.set())
+    signal.signal(signal.SIGTERM, lambda *_: control.quit.set())
+    server = serve(socket_path, control) if socket_path else None
+    print(f"Recorder running, pid {os.getpid()}" + (f", control socket {socket_path}" if server else ""))
+
+    with SeekCameraManager(SeekCameraIOType.USB) as manager:
+        control.session.start(manager)
+        written = 0
+        last = time.monotonic()
+        while not control.quit.wait(interval):
+            now = time.monotonic()
+            total = control.session.frames_written()
+            print(time.strftime("%H:%M:%S"), f"recording {control.recording.is_set()}, {(total - written) / (now - last):.1f} frames/s written", flush=True)
+            for line in control.session.stats():
+                print("  " + line)
+            written, last = total, now
+        control.session.close() # The cameras are stopped while their manager still exists
+
+    if server:
+        server.shutdown()
+        server.server_close()
+        os.remove(socket_path)
+    print(f"Stopped, {control.session.frames_written()} frames written")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Headless recorder", description="Records thermal and visible frames without a window")
+    parser.add_argument("--record", action="store_true", default=config["recorder"].getboolean("auto_record"), help="Start recording right away")
+    parser.add_argument("--socket", default=config["recorder"].get("control_socket"), help="Control socket path, empty disables it")
+    parser.add_argument("--interval", type=float, default=config["recorder"].getfloat("stats_interval"), help="Seconds between statistics")
+    parser.add_argument("--send", choices=COMMANDS, help="Send a command to a running recorder and exit")
+    compressions = list(exrutils.COMPRESSIONS) + ["auto"]
+    parser.add_argument("--visible-compression", choices=compressions)
+    parser.add_argument("--thermal-compression", choices=compressions)
+    args = parser.parse_args()
+
+    if args.send:
+        print(send(args.socket, args.send))
+    else:
+        if args.visible_compression:
+            config["recorder"]["visible_compression"] = args.visible_compression
+        if args.thermal_compression:
+            config["recorder"]["thermal_compression"] = args.thermal_compression
+        run(Control(args.record), args.socket, args.interval)
@@ -1,3 +1,6 @@
+import functools
+from typing import Optional
+
 import numpy as np
 import cv2
 
@@ -58,4 +61,46 @@ COLOR_SCALES = [
     ("Linear", lambda arr: normalize(arr)),
     ("sqrt", lambda arr: np.sqrt(normalize(arr))),
     ("x^2", lambda arr: np.square(normalize(arr))),
-]
\ No newline at end of file
+]
+
+# Lookup tables
+# Every palette and scale is evaluated once on LUT_SIZE evenly spaced values, colorizing a frame is then one
+# quantization of the data and one gather from the table.
+
+LUT_SIZE = 4096
+
+@functools.lru_cache(maxsize=None)
+def color_lut(palette: int, scale: int, size: int = LUT_SIZE) -> np.ndarray:
+    ramp = np.linspace(0.0, 1.0, size, dtype=np.float32).reshape(size, 1, 1)
+    return np.ascontiguousarray(COLOR_PALETTES[palette][1](COLOR_SCALES[scale][1](ramp)).reshape(size, 3))
+
+# RGB0 packed into one 32 bit word per entry, gathering single words is much faster than gathering rows
+@functools.lru_cache(maxsize=None)
+def packed_lut(palette: int, scale: int, size: int = LUT_SIZE) -> np.ndarray:
+    lut = np.zeros((size, 4), dtype=np.uint8)
+    lut[:,:3] = color_lut(palette, scale, size)
+    return lut.view(np.uint32).reshape(size)
+
+def quantize(arr: np.ndarray, levels: int, value_range: Optional[tuple[float,float]] = None) -> np.ndarray:
+    '''Maps arr linearly to uint16 indices 0..levels-1, rounded to nearest. Without a range the min and max of arr are used.'''
+    arr = np.ascontiguousarray(arr, dtype=np.float32)
+    if value_range is None:
+        return cv2.normalize(arr, None, 0, levels-1, cv2.NORM_MINMAX, cv2.CV_16U)
+    min_, max_ = value_range
+    factor = (levels-1) / (max_ - min_) if max_ != min_ else 0.0
+    index = cv2.addWeighted(arr, factor, arr, 0.0, -min_*factor, dtype=cv2.CV_16U) # Saturates below 0
+    return np.minimum(index, levels-1, out=index)
+
+'''
+Returns the (...,3) uint8 image of the 2D arr, a trailing channel axis of size 1 is dropped.
+value_range: fixed (min, max), defaults to the range of arr
+out: preallocated uint8 output
+'''
+def colorize(arr: np.ndarray, palette: int, scale: int, value_range: Optional[tuple[float,float]] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+    if arr.ndim == 3 and arr.shape[2] == 1:
+        arr = arr[:,:,0]
+    lut = packed_lut(palette, scale)
+    rgb0 = np.take(lut, quantize(arr, len(lut), value_range)).view(np.uint8).reshape(arr.shape + (4,))
+    if out is None or out.shape != arr.shape + (3,):
+        out = np.empty(arr.shape + (3,), dtype=np.uint8)
+    return cv2.cvtColor(rgb0, cv2.COLOR_RGBA2RGB, dst=out)
@@ -0,0 +1,21 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def ordered_map(fn, chunks, workers: int):
+    '''
+    Maps fn over chunks in a process pool and yields the results in order.
+    At most 2*workers chunks are in flight so memory use stays flat.
+    '''
+    if workers <= 1:
+        for i in chunks:
+            yield fn(*i)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for i in chunks:
+            pending.append(executor.submit(fn, *i))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
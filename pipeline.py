@@ -0,0 +1,145 @@
+import time
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+import exrutils
+from autocodec import AutoCompression
+from framering import FrameRing
+from framestats import FrameStatsWriter
+from videocapture import BufferlessVideoCapture, PairingStats
+
+class Frame:
+    '''A thermal frame and the visible frame captured closest to it, times are seconds since the epoch, camera is the chip id.'''
+    def __init__(self, thermal: np.ndarray, rgb: np.ndarray, thermal_time: float, visible_time: float, camera: str = ""):
+        self.thermal = thermal
+        self.rgb = rgb
+        self.thermal_time = thermal_time
+        self.visible_time = visible_time
+        self.camera = camera
+
+class StageStats:
+    '''Time from the thermal capture until a stage is done with a frame, over the last window frames.'''
+    def __init__(self, name: str, window: int = 100):
+        self.name = name
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.frames = 0
+        self.dropped = 0
+
+    def add(self, latency: float):
+        self.latencies.append(latency)
+        self.frames += 1
+
+    def __str__(self) -> str:
+        if not self.latencies:
+            return f"{self.name}: no frames, dropped {self.dropped}"
+        latencies = np.array(self.latencies) * 1000
+        return f"{self.name} {latencies[-1]:.1f} ms (mean {latencies.mean():.1f} ms), {self.frames} frames, dropped {self.dropped}"
+
+def put_latest(q: queue.Queue, item) -> bool:
+    '''Puts item without waiting, the oldest item makes room if q is full. Returns False if one was replaced.'''
+    replaced = False
+    while True:
+        try:
+            q.put_nowait(item)
+            return not replaced
+        except queue.Full:
+            try:
+                q.get_nowait()
+                replaced = True
+            except queue.Empty:
+                pass
+
+class Stage(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class CaptureStage(Stage):
+    '''
+    Waits for thermal frames, pairs each one with the closest visible frame and hands it on.
+    The frame_condition of source is notified with source.frame and source.timestamp set, like the camera callback does.
+    Capture never waits for the later stages: a frame that does not fit into the write queue is dropped and counted,
+    the preview queue only keeps the newest frames.
+    '''
+    def __init__(self, source, cam: BufferlessVideoCapture, frames: queue.Queue, previews: Optional[queue.Queue] = None, camera: str = ""):
+        super().__init__()
+        self.source = source
+        self.camera = camera
+        self.cam = cam
+        self.frames = frames
+        self.previews = previews
+        self.pairing = PairingStats()
+        self.stats = StageStats("capture")
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.source.frame_condition:
+                if not self.source.frame_condition.wait(0.15) or self.source.frame is None:
+                    continue
+                thermal = self.source.frame.data.astype(np.float32)
+                thermal_time = self.source.timestamp
+            bgr, visible_time, _ = self.cam.nearest(thermal_time)
+            if bgr is None:
+                bgr = np.zeros((1,1,3), dtype=np.uint8)
+                visible_time = thermal_time
+            self.pairing.add(visible_time - thermal_time)
+            frame = Frame(thermal, cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), thermal_time, visible_time, self.camera)
+            try:
+                self.frames.put_nowait(frame)
+            except queue.Full:
+                self.stats.dropped += 1
+            if self.previews is not None:
+                put_latest(self.previews, frame)
+            self.stats.add(time.time() - thermal_time)
+
+class WriteStage(Stage):
+    '''Names recorded frames and queues them in the frame ring, frames are only kept while recording() is true.'''
+    def __init__(self, frames: queue.Queue, ring: FrameRing, codec: AutoCompression, write_path: str | Path, recording: Callable[[], bool], stats_writer: Optional[FrameStatsWriter] = None):
+        super().__init__()
+        self.frames = frames
+        self.ring = ring
+        self.codec = codec
+        self.write_path = Path(write_path)
+        self.recording = recording
+        self.stats_writer = stats_writer
+        self.frame_counter = 1
+        self.status = "Not recording"
+        self.stats = StageStats("write")
+
+    def run(self):
+        # Frames that were captured before stop() are still written
+        while not self.stopped.is_set() or not self.frames.empty():
+            try:
+                frame = self.frames.get(timeout=0.15)
+            except queue.Empty:
+                continue
+            if not self.recording():
+                self.frame_counter = 1
+                self.codec.reset()
+                self.status = "Not recording"
+                continue
+            timestamp = int(frame.thermal_time*1000)
+            file_name = str(self.write_path / f"{timestamp}:{self.frame_counter:04}.exr")
+            extra = {"thermal_time": frame.thermal_time*1000, "visible_time": frame.visible_time*1000}
+            if frame.camera:
+                extra["camera"] = frame.camera
+            options = self.codec(frame.rgb, frame.thermal)
+            if self.ring.put(frame.rgb, frame.thermal, file_name, **options, **extra) and self.stats_writer:
+                # The statistics describe the values as they are stored, not the camera's float32 frame
+                stored = exrutils.stored_thermal(frame.thermal, options.get("thermal_format", "float"), options.get("thermal_quantization", exrutils.THERMAL_QUANTIZATION))
+                self.stats_writer.append(timestamp, self.frame_counter, stored)
+            self.status = file_name
+            if self.codec.auto:
+                self.status += f"\nauto {self.codec.choice} at {self.codec.fps:.1f} fps"
+            self.frame_counter += 1
+            self.stats.add(time.time() - frame.thermal_time)
@@ -0,0 +1,32 @@
+import numpy as np
+
+class PlaybackScheduler:
+    '''
+    Maps elapsed wall-clock time to a frame index using the recorded timestamps (ms).
+    Frames between the current and the target frame are skipped, not decoded.
+    '''
+    def __init__(self, timestamps: np.ndarray, index: int = 0):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.dropped = 0
+        self.step = 1 # Frames advanced by the last jump, used as the prefetch stride
+        self.seek(index)
+
+    def seek(self, index: int):
+        self.index = index
+        self.position = float(self.timestamps[index]) if len(self.timestamps) else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.index >= len(self.timestamps)-1
+
+    def advance(self, elapsed_ms: float, speed: float = 1.0) -> int:
+        if self.finished:
+            return self.index
+        self.position += elapsed_ms*speed
+        target = int(np.searchsorted(self.timestamps, self.position, side="right")) - 1
+        target = min(max(target, self.index), len(self.timestamps)-1)
+        if target != self.index:
+            self.dropped += target - self.index - 1
+            self.step = target - self.index
+        self.index = target
+        return target
@@ -1,14 +1,20 @@
 import os
 from glob import glob
 from typing import Optional, Callable, Self
-from pathlib import Path
 import math
+import time
 
 import cv2
 import pygame as pg
 import numpy as np
 
-import exrutils, imageutils, fsutils
+import imageutils, fsutils, roi, colorrange
+from front import Front, FrontTracker
+from denoise import FILTERS, make_filter
+from framecache import FrameCache
+from frameindex import FrameIndex
+from framestats import FrameStats
+from playback import PlaybackScheduler
 from config import config
 
 pg.init()
@@ -204,32 +210,79 @@ class ThermalImage(Figure, Hoverable, Clickable):
         super().__init__(rect, surface, text)
         self.initial_text = text
         self.celsius_array = celsius_array
+        self.rgb: Optional[np.ndarray] = None # Reused colorization buffer
+        self.value_range: Optional[tuple[float,float]] = None # Fixed (min, max) of the whole recording, None scales every frame by itself
+        self.frame_id = 0
+        self.base: Optional[pg.Surface] = None # Colorized frame without the point markers
+        self._base_key = None
+        self._marker_rects: list[pg.Rect] = []
         
         self.palette_picker = ListSelection(pg.Rect((0,0),(0,0)), [i[0] for i in imageutils.COLOR_PALETTES], config["player"].getint("color_palette"))
         self.scale_picker = ListSelection(pg.Rect((0,0),(0,0)), [i[0] for i in imageutils.COLOR_SCALES], config["player"].getint("color_scale"))
         self.palette_picker.selection_changed = lambda _: self.colorize()
         self.scale_picker.selection_changed = lambda _: self.colorize()
         
-        self.points = [ThermalPoint(name = "Min", color_index=-1, self_updated=self.colorize), ThermalPoint(name = "Max", color_index=-2, self_updated=self.colorize)]
+        self.points = [ThermalPoint(name = "Min", color_index=-1, self_updated=self.draw_points), ThermalPoint(name = "Max", color_index=-2, self_updated=self.draw_points)]
         self.points_overlay = pg.Surface(self.rect.size, pg.SRCALPHA)
+        self.front_tracker: Optional[FrontTracker] = None
+        self.front: Optional[Front] = None
+        self.timestamp = 0.0 # Capture time of celsius_array in s
 
     def hovered(self, pos, local_pos):
         self.label.update_text(f"{self.initial_text}\n{self.celsius_array[local_pos][0]:.2f}°C")
     
     def colorize(self):
-        self.update_surface(pg.surfarray.make_surface(imageutils.COLOR_PALETTES[self.palette_picker.selected][1](imageutils.COLOR_SCALES[self.scale_picker.selected][1](self.celsius_array))))
-        for i in self.points:
-            if i.is_toggled:
-                pg.draw.circle(self.surface, ThermalPoint.COLORS[i.color_index], i.pos, 2.0)
+        key = (self.frame_id, self.palette_picker.selected, self.scale_picker.selected, self.value_range)
+        if key == self._base_key:
+            self.draw_points()
+            return
+        self._base_key = key
 
-    def update_data(self, celsius_array: np.ndarray):
+        self.rgb = imageutils.colorize(self.celsius_array, self.palette_picker.selected, self.scale_picker.selected, self.value_range, out=self.rgb)
+        if self.base and self.base.get_size() == self.rgb.shape[:2]:
+            pg.surfarray.blit_array(self.base, self.rgb)
+        else:
+            self.base = pg.surfarray.make_surface(self.rgb)
+            self.points_overlay = pg.Surface(self.base.get_size(), pg.SRCALPHA)
+            self._marker_rects = []
+            self.update_surface(self.base.copy())
+        self.surface.blit(self.base, (0,0))
+        self.draw_points()
+
+    def draw_points(self):
+        '''Redraws the point markers on their own layer and recomposes only the areas they cover or covered.'''
+        if not self.base:
+            return
+        dirty = self._marker_rects
+        for i in dirty:
+            self.points_overlay.fill((0,0,0,0), i)
+        self._marker_rects = [pg.draw.circle(self.points_overlay, ThermalPoint.COLORS[i.color_index], i.pos, 2.0) for i in self.points if i.is_toggled]
+        if self.front and self.front.contour is not None and len(self.front.contour) > 1:
+            self._marker_rects.append(pg.draw.lines(self.points_overlay, config["front"]["color"], True, self.front.contour.tolist()))
+        for i in dirty + self._marker_rects:
+            self.surface.blit(self.base, i, i)
+            self.surface.blit(self.points_overlay, i, i)
+
+    # extrema: flat (y,x) argmin and argmax from the frame statistics table
+    # timestamp: capture time in s for the front velocity
+    def update_data(self, celsius_array: np.ndarray, extrema: Optional[tuple[int,int]] = None, timestamp: Optional[float] = None):
         self.celsius_array = celsius_array
-        mini = np.unravel_index(celsius_array.argmin(), celsius_array.shape)
-        maxi = np.unravel_index(celsius_array.argmax(), celsius_array.shape)
-        self.points[0].pos = mini[0], mini[1]
-        self.points[1].pos = maxi[0], maxi[1]
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.front_tracker:
+            # The array is (x,y), its transpose is the (y,x) frame and (x,y) contour points stay (x,y) on the surface
+            self.front = self.front_tracker.update(celsius_array[:,:,0].T, self.timestamp)
+        if extrema:
+            w = celsius_array.shape[0]
+            mini = extrema[0] % w, extrema[0] // w
+            maxi = extrema[1] % w, extrema[1] // w
+        else:
+            mini = np.unravel_index(celsius_array.argmin(), celsius_array.shape)
+            maxi = np.unravel_index(celsius_array.argmax(), celsius_array.shape)
+        self.points[0].pos = int(mini[0]), int(mini[1])
+        self.points[1].pos = int(maxi[0]), int(maxi[1])
         for i in self.points:
             i.update_temp(self.celsius_array)
+        self.frame_id += 1
         self.colorize()
     
     def palette_changed(self, new_selection: int):
@@ -249,16 +302,76 @@ class ThermalImage(Figure, Hoverable, Clickable):
         for i in [self.palette_picker, self.scale_picker] + self.points:
             i.handle_event(event)
     
+    def track_front(self, isotherm: Optional[float]):
+        '''Starts following the isotherm front, None stops.'''
+        self.front_tracker = FrontTracker(isotherm, config["front"].getint("band")) if isotherm is not None else None
+        self.front = None
+        if self.front_tracker and self.celsius_array is not None:
+            self.front = self.front_tracker.update(self.celsius_array[:,:,0].T, self.timestamp)
+        self.draw_points()
+
+    def point_rois(self) -> list[roi.Roi]:
+        # The first two points follow the min and max
+        return [roi.Roi("point", [int(i.pos[0]), int(i.pos[1])], i.name) for i in self.points[2:]]
+
     def point_destroyed(self, point: ThermalPoint):
         self.points.remove(point)
-        self.colorize()
+        self.draw_points()
     
     def clicked(self, pos, local_pos, event):
         if event.button != pg.BUTTON_LEFT:
             return
-        self.points.append(ThermalPoint(local_pos, "", self_updated = self.colorize, self_destroyed=self.point_destroyed))
+        self.points.append(ThermalPoint(local_pos, "", self_updated = self.draw_points, self_destroyed=self.point_destroyed))
         self.points[-1].update_temp(self.celsius_array)
-        self.colorize()
+        self.draw_points()
+
+class Timeline(Clickable):
+    '''Min, mean and max temperature of the whole sequence from the frame statistics table, click to seek.'''
+    SERIES = [("min", "blue"), ("mean", "cornsilk"), ("max", "red")]
+
+    def __init__(self, rect: pg.Rect, seek: Callable[[int],None] = lambda i: None):
+        super().__init__(rect, None)
+        self.size = rect.size
+        self.seek = seek
+        self.length = 0
+        self.position = 0
+        self.set_data(None)
+
+    def set_data(self, records: Optional[np.ndarray]):
+        if records is None or len(records) == 0:
+            self.length = 0
+            self.update_surface(pg.Surface((0,0)))
+            return
+
+        self.length = len(records)
+        w, h = self.size
+        surface = pg.Surface(self.size, pg.SRCALPHA)
+        surface.fill((0,0,0,128))
+        # One value per pixel column
+        starts = np.linspace(0, self.length, min(w, self.length), endpoint=False).astype(np.int64)
+        lo, hi = float(records["min"].min()), float(records["max"].max())
+        for name, color in Timeline.SERIES:
+            if name == "min":
+                values = np.minimum.reduceat(records[name], starts)
+            elif name == "max":
+                values = np.maximum.reduceat(records[name], starts)
+            else:
+                values = np.add.reduceat(records[name].astype(np.float64), starts) / np.diff(np.append(starts, self.length))
+            ys = (h-1) - imageutils.normalize_on_range(values.astype(np.float64), lo, hi)*(h-1)
+            xs = np.linspace(0, w-1, len(values))
+            if len(values) > 1:
+                pg.draw.lines(surface, color, False, list(zip(xs, ys)))
+        self.update_surface(surface)
+
+    def render(self, screen):
+        super().render(screen)
+        if self.length:
+            x = self.rect.left + self.position * (self.rect.width-1) // max(self.length-1, 1)
+            pg.draw.line(screen, "yellow", (x, self.rect.top), (x, self.rect.bottom-1))
+
+    def clicked(self, pos, local_pos, event):
+        if self.length and event.button == pg.BUTTON_LEFT:
+            self.seek(min(local_pos[0] * self.length // self.rect.width, self.length-1))
 
 DynPos = Optional[Callable[[pg.Surface],tuple[float,float]]]
 class Anchor(Element):
@@ -294,13 +407,20 @@ rgb_image_element = Figure(pg.Rect((0,0),(0,0)), None, "Visible")
 thermal_image_element = ThermalImage(pg.Rect((0,0),(0,0)), None, "Temperature", None)
 file_info_label = Label(pg.Rect((0,0),(0,0)), None, "No file loaded")
 play_button = Toggle(pg.Rect((0,0),(0,0)), None, "Play/Pause", toggled=config["player"].getboolean("auto_play"))
+timeline = Timeline(pg.Rect((0,0),(640,80)))
 
-def update_images(new_rgb_array: np.ndarray, new_celsius_array: np.ndarray, filename: str):
+# stats: record from the frame statistics table, if there is one
+# new_rgb_array is float 0..1 or uint8, thermal=False only updates the visible image and the text
+# timestamp: capture time in s, defaults to now
+def update_images(new_rgb_array: np.ndarray, new_celsius_array: np.ndarray, filename: str, stats: Optional[np.ndarray] = None, thermal: bool = True, timestamp: Optional[float] = None):
     new_rgb_array = np.transpose(new_rgb_array, (1,0,2))
-    new_celsius_array = np.transpose(new_celsius_array.reshape(new_celsius_array.shape[0], new_celsius_array.shape[1], 1), (1,0,2))
-    rgb_image_element.update_surface(pg.surfarray.make_surface((new_rgb_array * 255.0).astype(np.uint8)))
-    thermal_image_element.update_data(new_celsius_array)
+    rgb_image_element.update_surface(pg.surfarray.make_surface(new_rgb_array if new_rgb_array.dtype == np.uint8 else (new_rgb_array * 255.0).astype(np.uint8)))
+    if thermal:
+        new_celsius_array = np.transpose(new_celsius_array.reshape(new_celsius_array.shape[0], new_celsius_array.shape[1], 1), (1,0,2))
+        thermal_image_element.update_data(new_celsius_array, (int(stats["argmin"]), int(stats["argmax"])) if stats is not None else None, timestamp)
     thermal_image_element.rect.topleft = rgb_image_element.rect.topright
+    if thermal_image_element.front:
+        filename += f"\n{thermal_image_element.front_tracker.isotherm:.2f}°C {thermal_image_element.front}"
     file_info_label.update_text(filename)
     file_info_label.rect.topleft = thermal_image_element.rect.topright
 
@@ -309,19 +429,85 @@ elements: list[Element] = [
     thermal_image_element,
     Anchor(file_info_label, bottomright=lambda screen: (screen.get_width(), screen.get_height())),
     Anchor(play_button, bottomleft=lambda screen: (0, screen.get_height())),
+    Anchor(timeline, bottomleft=lambda screen: (0, screen.get_height() - play_button.rect.height)),
 ]
 
 def loop():
-    image_file_list: list[str] = []
+    image_file_list: FrameIndex = FrameIndex.empty()
     image_file_index: int = 0
+    frame_cache: Optional[FrameCache] = None
+    scheduler: Optional[PlaybackScheduler] = None
+    frame_stats: Optional[np.ndarray] = None
+    filter_kind = config["filter"].get("kind")
+    denoise = make_filter(filter_kind) # Between the frame cache and the display
+
+    def show_frame(direction: int = 1, step: int = 1):
+        text = image_file_list[image_file_index]
+        if scheduler and scheduler.dropped:
+            text += f"\nSkipped {scheduler.dropped} frames"
+        timestamp = image_file_list.timestamps[image_file_index] / 1000.0 if image_file_list.valid else None
+        rgb, thermal = frame_cache.get(image_file_index)
+        stats = frame_stats[image_file_index] if frame_stats is not None else None
+        if denoise:
+            thermal = denoise(thermal)
+            text += f"\n{filter_kind} filter"
+            stats = None # The table holds unfiltered values
+        update_images(rgb, thermal, text, stats, timestamp=timestamp)
+        frame_cache.prefetch(image_file_index, direction, step)
+        timeline.position = image_file_index
+
+    def seek(index: int):
+        nonlocal image_file_index
+        direction = index - image_file_index
+        image_file_index = index
+        if scheduler:
+            scheduler.seek(index)
+        if direction != 1:
+            # Fronts and filters are only followed from one frame to the next
+            if thermal_image_element.front_tracker:
+                thermal_image_element.front_tracker.reset()
+            if denoise:
+                denoise.reset()
+        show_frame(direction)
+    timeline.seek = seek
+
+    def load_color_range(fixed: bool):
+        thermal_image_element.value_range = colorrange.color_range(image_file_list, workers=os.cpu_count()) if fixed else None
+        if thermal_image_element.value_range:
+            print("Fixed color range {:.2f} - {:.2f} °C".format(*thermal_image_element.value_range))
+
+    def load_frame_stats():
+        nonlocal frame_stats
+        table = FrameStats.open(image_file_list.directory)
+        frame_stats = table.lookup(image_file_list) if table else None
+        timeline.set_data(frame_stats)
 
     def open_path(path: str):
-        nonlocal image_file_list, image_file_index
+        nonlocal image_file_list, image_file_index, frame_cache, scheduler
         
+        if frame_cache:
+            frame_cache.close()
+            frame_cache = None
+        image_file_list.close()
         image_file_list, image_file_index = fsutils.file_range(path)
+        if thermal_image_element.front_tracker:
+            thermal_image_element.front_tracker.reset()
+        if denoise:
+            denoise.reset()
+        load_frame_stats()
+        load_color_range(config["player"].getboolean("fixed_range"))
+        scheduler = PlaybackScheduler(image_file_list.timestamps, image_file_index) if image_file_list.valid else None
+        frame_cache = FrameCache(
+            image_file_list.read_dual_image,
+            len(image_file_list),
+            config["player"].getfloat("cache_mb"),
+            config["player"].getint("prefetch_ahead"),
+            config["player"].getint("prefetch_behind"),
+            config["player"].getint("prefetch_workers"),
+        )
         
         if image_file_list:
-            update_images(*exrutils.read_dual_image(image_file_list[image_file_index]), image_file_list[image_file_index])
+            show_frame()
         else:
             update_images(np.random.rand(480,640,3), np.linspace(20.0, 40.0, 240*320, dtype=np.float32).reshape(240, 320, 1), "No files found! Showing example data") # Generate random rgb data and temperature values from 20C to 40C
 
@@ -330,24 +516,25 @@ def loop():
     screen = pg.display.set_mode((1280, 720), pg.RESIZABLE)
     clock = pg.time.Clock()
     running = True
-    tof = 0
 
     while running:
         if play_button.is_toggled:
+            if image_file_index >= len(image_file_list)-1 and image_file_list.update():
+                # Follow a recording that is still being written
+                frame_cache.length = len(image_file_list)
+                if scheduler:
+                    scheduler.timestamps = image_file_list.timestamps
+                load_frame_stats()
             if image_file_index >= len(image_file_list)-1:
                 play_button.set_toggle(False)
+            elif not scheduler:
+                print(f"Invalid file name: {image_file_list[image_file_index]}")
+                play_button.set_toggle(False)
             else:
-                tof += clock.get_time()*config["player"].getfloat("playback_speed")
-                try:
-                    t1 = int(os.path.basename(image_file_list[image_file_index]).split(":")[0])
-                    t2 = int(os.path.basename(image_file_list[image_file_index+1]).split(":")[0])
-                    if tof > t2-t1:
-                        tof -= t2-t1
-                        image_file_index += 1
-                        update_images(*exrutils.read_dual_image(image_file_list[image_file_index]), image_file_list[image_file_index])
-                except ValueError:
-                    print(f"Invalid file name: {image_file_list[image_file_index]}")
-                    play_button.set_toggle(False)
+                new_index = scheduler.advance(clock.get_time(), config["player"].getfloat("playback_speed"))
+                if new_index != image_file_index:
+                    image_file_index = new_index
+                    show_frame(1, scheduler.step)
         for event in pg.event.get():
             if event.type == pg.QUIT:
                 running = False
@@ -360,6 +547,32 @@ def loop():
                 if event.key == pg.K_SPACE:
                     play_button.set_toggle(not play_button.is_toggled)
 
+                if event.key == pg.K_r:
+                    load_color_range(thermal_image_element.value_range is None)
+                    thermal_image_element.colorize()
+
+                if event.key == pg.K_f:
+                    # The isotherm is the temperature at the last placed point
+                    placed = thermal_image_element.points[2:]
+                    isotherm = float(placed[-1].temp[0]) if placed else config["front"].getfloat("isotherm")
+                    thermal_image_element.track_front(None if thermal_image_element.front_tracker else isotherm)
+
+                if event.key == pg.K_n:
+                    filter_kind = FILTERS[(FILTERS.index(filter_kind) + 1) % len(FILTERS)]
+                    denoise = make_filter(filter_kind)
+                    print(f"Temporal filter: {filter_kind}")
+                    if image_file_list:
+                        show_frame(0)
+
+                if event.key == pg.K_c:
+                    print(f"Frame cache: {frame_cache.stats()}")
+
+                if event.key == pg.K_s:
+                    roi_path = config["export"]["roi_path"]
+                    os.makedirs(os.path.dirname(roi_path) or ".", exist_ok=True)
+                    roi.save_rois(roi_path, thermal_image_element.point_rois())
+                    print(f"Saved points to {roi_path}, export them with: export.py csv {image_file_list.directory} --roi {roi_path}")
+
                 old = image_file_index
                 if event.key == pg.K_RIGHT:
                     image_file_index += 1
@@ -375,8 +588,8 @@ def loop():
                     image_file_index = 0
                 image_file_index = min(max(image_file_index, 0), max(len(image_file_list)-1, 0))
                 if image_file_index != old:
-                    tof = 0
-                    update_images(*exrutils.read_dual_image(image_file_list[image_file_index]), image_file_list[image_file_index])
+                    new_index, image_file_index = image_file_index, old
+                    seek(new_index)
 
             for i in elements:
                 i.handle_event(event)
@@ -393,6 +606,8 @@ def loop():
 
         clock.tick(60)
 
+    frame_cache.close()
+    image_file_list.close()
     pg.quit()
 
 if __name__ == "__main__":
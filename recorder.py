@@ -1,85 +1,31 @@
 import time
-from threading import Condition
-from typing import Optional
-from concurrent.futures import ProcessPoolExecutor
+import queue
+import argparse
 
 import cv2
 import numpy as np
 import pygame as pg
-from pathlib import Path
-from seekcamera import (
-    SeekCameraIOType,
-    SeekCameraColorPalette,
-    SeekCameraManager,
-    SeekCameraManagerEvent,
-    SeekCameraFrameFormat,
-    SeekCameraFrame,
-    SeekCameraError,
-    SeekCamera,
-    SeekFrame,
-)
+from seekcamera import SeekCameraIOType, SeekCameraManager
 
-import exrutils
 import player
-from videocapture import BufferlessVideoCapture
+import exrutils
+from pipeline import StageStats
+from session import RecordingSession
 from config import config
 
-class Renderer:
-    def __init__(self):
-        self.busy = False
-        self.frame = SeekFrame()
-        self.camera = SeekCamera()
-        self.frame_condition = Condition()
-
-
-def on_frame(_camera: SeekCamera, camera_frame: SeekCameraFrame, renderer: Renderer):
-    print("Frame")
-    with renderer.frame_condition:
-        renderer.frame = camera_frame.thermography_float
-        renderer.frame_condition.notify()
-
-
-def on_event(camera: SeekCamera, event_type: SeekCameraManagerEvent, event_status: Optional[SeekCameraError], renderer: Renderer):
-    print("{}: {}".format(str(event_type), camera.chipid))
-
-    if event_type == SeekCameraManagerEvent.CONNECT:
-        if renderer.busy:
-            return
-
-        renderer.busy = True
-        renderer.camera = camera
-        
-        camera.color_palette = SeekCameraColorPalette.TYRIAN
-        camera.register_frame_available_callback(on_frame, renderer)
-        camera.capture_session_start(SeekCameraFrameFormat.THERMOGRAPHY_FLOAT)
-
-    elif event_type == SeekCameraManagerEvent.DISCONNECT:
-        if renderer.camera == camera:
-            camera.capture_session_stop()
-            renderer.camera = None
-            renderer.frame = None
-            renderer.busy = False
-
-    elif event_type == SeekCameraManagerEvent.ERROR:
-        print("{}: {}".format(str(event_status), camera.chipid))
-
-    elif event_type == SeekCameraManagerEvent.READY_TO_PAIR:
-        return
-
-
 def bgr_white_hot(img: np.ndarray) -> np.ndarray:
     return cv2.cvtColor((img*255.0).astype(np.uint8), cv2.COLOR_GRAY2BGR)
 
 
 def loop():
-    cid = config["recorder"].get("camera")
-    try:
-        cid = int(cid)
-    except ValueError:
-        pass
-    cam = BufferlessVideoCapture(cid)
-    executor = ProcessPoolExecutor() # Image export is done in another process
-    frame_counter = 1
+    # Capture and write run on their own threads, the preview only shows the newest frame at up to preview_fps
+    # Every camera keeps its newest frame, TAB switches between the connected cameras
+    session = RecordingSession(lambda: player.play_button.is_toggled, previews=True)
+    selected = 0
+    preview_fps = config["recorder"].getfloat("preview_fps")
+    preview_colorize = config["recorder"].getboolean("preview_colorize")
+    preview_stats = StageStats("preview")
+    last_preview = 0.0
     player.update_images(np.random.rand(480,640,3), np.linspace(20.0, 40.0, 240*320, dtype=np.float32).reshape(240, 320, 1), "No data found! Showing example data") # Generate random rgb data and temperature values from 20C to 40C
 
     screen = pg.display.set_mode((1280, 720), pg.RESIZABLE)
@@ -89,27 +35,26 @@ def loop():
     player.play_button.set_toggle(config["recorder"].getboolean("auto_record"))
 
     with SeekCameraManager(SeekCameraIOType.USB) as manager:
-        renderer = Renderer()
-        manager.register_event_callback(on_event, renderer)
+        session.start(manager)
 
         while running:
-            with renderer.frame_condition:
-                if renderer.frame_condition.wait(150.0 / 1000.0):
-                    print("Render")
-                    bgr_frame = cam.read()
-                    if bgr_frame is None:
-                        bgr_frame = np.zeros((1,1,3), dtype='float32')
-                    rgb_frame = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB).astype('float32')/255.0
-                    thermal_data = renderer.frame.data.astype('float32')
-                    
-                    file_name = "Not recording"
-                    if player.play_button.is_toggled:
-                        file_name = str(Path(config["recorder"].get("write_path")) / f"{int(time.time()*1000)}:{frame_counter:04}.exr")
-                        executor.submit(exrutils.write_dual_image, rgb_frame, thermal_data, file_name)
-                    else:
-                        frame_counter = 0
-                    player.update_images(rgb_frame, thermal_data, file_name)
-                    frame_counter += 1
+            cameras = session.sessions()
+            frame = None
+            if cameras:
+                camera = cameras[selected % len(cameras)]
+                try:
+                    frame = camera.previews.get_nowait()
+                except queue.Empty:
+                    pass
+            if frame is not None:
+                now = time.monotonic()
+                if preview_fps <= 0 or now - last_preview >= 1.0 / preview_fps:
+                    last_preview = now
+                    text = "\n".join([f"camera {camera.chipid} ({selected % len(cameras) + 1}/{len(cameras)})"] + session.stats() + [str(preview_stats)])
+                    player.update_images(frame.rgb, frame.thermal, text, thermal=preview_colorize)
+                    preview_stats.add(time.time() - frame.thermal_time)
+                else:
+                    preview_stats.dropped += 1
 
             for event in pg.event.get():
                 if event.type == pg.QUIT:
@@ -119,6 +64,8 @@ def loop():
                         running = False
                     elif event.key == pg.K_SPACE:
                         player.play_button.set_toggle(not player.play_button.is_toggled)
+                    elif event.key == pg.K_TAB:
+                        selected += 1
                 for i in player.elements:
                     i.handle_event(event)
 
@@ -134,9 +81,18 @@ def loop():
 
             clock.tick(60)
 
-    cam.close()
+        session.close() # The cameras are stopped while their manager still exists
     pg.quit()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Recorder", description="Records thermal and visible frames")
+    compressions = list(exrutils.COMPRESSIONS) + ["auto"]
+    parser.add_argument("--visible-compression", choices=compressions, help="Overrides the config, auto picks the strongest lossless codec that keeps up")
+    parser.add_argument("--thermal-compression", choices=compressions)
+    args = parser.parse_args()
+    if args.visible_compression:
+        config["recorder"]["visible_compression"] = args.visible_compression
+    if args.thermal_compression:
+        config["recorder"]["thermal_compression"] = args.thermal_compression
     loop()
\ No newline at end of file
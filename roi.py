@@ -0,0 +1,111 @@
+import json
+
+import cv2
+import numpy as np
+
+STATS = ["mean", "min", "max", "std"]
+
+'''
+A region of interest on the thermal image, all coordinates are (x,y)
+kind "point":      [x, y]
+kind "rect":       [x0, y0, x1, y1] inclusive
+kind "polygon":    [[x, y], ...]
+'''
+class Roi:
+    def __init__(self, kind: str, coords: list, name: str = ""):
+        if kind not in ("point", "rect", "polygon"):
+            raise ValueError(f"Unknown ROI kind {kind}")
+        self.kind = kind
+        self.coords = coords
+        self.name = name
+
+    def mask(self, shape: tuple[int,int]) -> np.ndarray:
+        mask = np.zeros(shape, dtype=np.uint8)
+        if self.kind == "point":
+            x, y = self.coords
+            mask[y, x] = 1
+        elif self.kind == "rect":
+            x0, y0, x1, y1 = self.coords
+            mask[min(y0,y1):max(y0,y1)+1, min(x0,x1):max(x0,x1)+1] = 1
+        else:
+            cv2.fillPoly(mask, [np.array(self.coords, dtype=np.int32)], 1)
+        return mask.astype(bool)
+
+    def to_dict(self) -> dict:
+        d = {self.kind: self.coords}
+        if self.name:
+            d["name"] = self.name
+        return d
+
+'''
+ROI file format, a JSON list:
+[{"name": "inlet", "point": [10, 20]}, {"rect": [0, 0, 9, 9]}, {"polygon": [[0, 0], [5, 0], [0, 5]]}]
+'''
+def load_rois(path: str) -> list[Roi]:
+    with open(path) as f:
+        entries = json.load(f)
+    rois = []
+    for i in entries:
+        kind = next(k for k in i if k != "name")
+        rois.append(Roi(kind, i[kind], i.get("name", "")))
+    return rois
+
+def save_rois(path: str, rois: list[Roi]):
+    with open(path, "w") as f:
+        json.dump([i.to_dict() for i in rois], f, indent=1)
+
+class RoiStats:
+    '''
+    Per-ROI statistics as one gather and a few vectorized reductions per frame.
+    The pixel indices of every ROI are precomputed into a padded (n_rois, max_pixels) matrix.
+    Only the scanline band covering all ROIs (self.rows) needs to be decoded.
+    '''
+    def __init__(self, rois: list[Roi], shape: tuple[int,int], stats: list[str] = STATS, percentiles: list[float] = []):
+        self.rois = rois
+        self.stats = stats
+        self.percentiles = percentiles
+
+        masks = [i.mask(shape) for i in rois]
+        rows = np.flatnonzero(np.any(masks, axis=(0,2))) if rois else np.array([0])
+        self.rows = (int(rows[0]), int(rows[-1])+1)
+        width = shape[1]
+
+        pixels = [np.flatnonzero(i[self.rows[0]:self.rows[1]]) for i in masks]
+        self.counts = np.array([len(i) for i in pixels])
+        if (self.counts == 0).any():
+            raise ValueError(f"ROI {rois[int(np.argmin(self.counts))].to_dict()} is outside of the {width}x{shape[0]} image")
+        self.valid = np.arange(self.counts.max()) < self.counts[:,None]
+        self.indices = np.zeros(self.valid.shape, dtype=np.int64)
+        self.indices[self.valid] = np.concatenate(pixels)
+
+    def columns(self) -> list[str]:
+        names = [i.name or f"{i.kind}{n}" for n, i in enumerate(self.rois)]
+        return [f"{name} {stat}" for name in names for stat in self.stats + [f"p{p:g}" for p in self.percentiles]]
+
+    def __call__(self, band: np.ndarray) -> np.ndarray:
+        '''band is the thermal image cropped to self.rows, returns (n_rois, n_columns)'''
+        values = band.reshape(-1)[self.indices].astype(np.float64)
+        out = []
+        mean = np.where(self.valid, values, 0.0).sum(axis=1) / self.counts
+        for stat in self.stats:
+            if stat == "mean":
+                out.append(mean)
+            elif stat == "min":
+                out.append(np.where(self.valid, values, np.inf).min(axis=1))
+            elif stat == "max":
+                out.append(np.where(self.valid, values, -np.inf).max(axis=1))
+            elif stat == "std":
+                out.append(np.sqrt(np.where(self.valid, (values - mean[:,None])**2, 0.0).sum(axis=1) / self.counts))
+            else:
+                raise ValueError(f"Unknown statistic {stat}")
+        if self.percentiles:
+            values[~self.valid] = np.nan
+            out.extend(np.nanpercentile(values, self.percentiles, axis=1))
+        return np.stack(out, axis=1)
+
+def parse_point(text: str) -> tuple[int,int]:
+    return tuple(map(int, text.split(",")))
+
+def split_rois(rois: list[Roi]) -> tuple[list[tuple[int,int]], list[Roi]]:
+    '''Points are exported as plain values, everything else as statistics.'''
+    return [tuple(i.coords) for i in rois if i.kind == "point"], [i for i in rois if i.kind != "point"]
@@ -0,0 +1,179 @@
+import os
+import time
+import queue
+from pathlib import Path
+from threading import Condition, Lock
+from typing import Callable, Optional
+
+from seekcamera import (
+    SeekCameraColorPalette,
+    SeekCameraManager,
+    SeekCameraManagerEvent,
+    SeekCameraFrameFormat,
+    SeekCameraFrame,
+    SeekCameraError,
+    SeekCamera,
+    SeekFrame,
+)
+
+import exrutils
+from framestats import FrameStatsWriter
+from framering import FrameRing
+from thermalseq import SequenceWriter, DeltaSequenceWriter
+from autocodec import AutoCompression
+from pipeline import CaptureStage, WriteStage
+from videocapture import BufferlessVideoCapture
+from config import config
+
+def on_frame(_camera: SeekCamera, camera_frame: SeekCameraFrame, session: "CameraSession"):
+    with session.frame_condition:
+        session.frame = camera_frame.thermography_float
+        session.timestamp = time.time()
+        session.frame_condition.notify()
+
+
+def on_event(camera: SeekCamera, event_type: SeekCameraManagerEvent, event_status: Optional[SeekCameraError], recording: "RecordingSession"):
+    print("{}: {}".format(str(event_type), camera.chipid))
+
+    if event_type == SeekCameraManagerEvent.CONNECT:
+        recording.connect(camera)
+
+    elif event_type == SeekCameraManagerEvent.DISCONNECT:
+        recording.disconnect(camera)
+
+    elif event_type == SeekCameraManagerEvent.ERROR:
+        print("{}: {}".format(str(event_status), camera.chipid))
+
+    elif event_type == SeekCameraManagerEvent.READY_TO_PAIR:
+        return
+
+
+def write_options() -> dict:
+    return {
+        "visible_format": config["recorder"].get("visible_format"),
+        "visible_downscale": config["recorder"].getint("visible_downscale"),
+        "thermal_format": config["recorder"].get("thermal_format"),
+        "thermal_quantization": (config["recorder"].getfloat("thermal_scale"), config["recorder"].getfloat("thermal_offset")),
+        "visible_compression": config["recorder"].get("visible_compression"),
+        "thermal_compression": config["recorder"].get("thermal_compression"),
+    }
+
+def camera_writers(cameras: int) -> int:
+    '''Writer processes of the camera connecting as the cameras-th one, the cores are split between at least max_cameras cameras.'''
+    writers = config["recorder"].getint("writers")
+    return writers if writers > 0 else max(1, os.cpu_count() // max(config["recorder"].getint("max_cameras"), cameras))
+
+class CameraSession:
+    '''
+    One thermal camera with its own frame condition, output subdirectory (the chip id), writer processes and
+    capture and write stages, so a camera whose disk stalls does not hold up the others.
+    '''
+    def __init__(self, chipid: str, cam: BufferlessVideoCapture, recording: Callable[[], bool], previews: bool = False, cameras: int = 1):
+        self.chipid = chipid
+        self.camera: Optional[SeekCamera] = None
+        self.frame: Optional[SeekFrame] = None
+        self.timestamp = 0.0 # Arrival time of frame, not when the capture stage gets to it
+        self.frame_condition = Condition()
+        write_path = Path(config["recorder"].get("write_path")) / chipid
+        os.makedirs(write_path, exist_ok=True)
+
+        # Image export is done in other processes, frames are handed over through shared memory
+        # "sequence" appends every frame to one .thseq file instead of writing an EXR file per frame, "delta" also stores the thermal images as deltas
+        storage = config["recorder"].get("storage")
+        sequence_path = write_path / config["recorder"].get("sequence_name")
+        writers = camera_writers(cameras)
+        self.sequence = None
+        if storage == "sequence":
+            self.sequence = SequenceWriter(sequence_path)
+        elif storage == "delta":
+            self.sequence = DeltaSequenceWriter(sequence_path, config["recorder"].getint("keyframe_interval"), config["recorder"].getint("delta_level"))
+            writers = 1 # Deltas are encoded in order
+        self.ring = FrameRing(config["recorder"].getint("ring_slots"), writers, config["recorder"].get("backpressure"), self.sequence or exrutils.write_dual_image)
+        codec = AutoCompression(write_options(), self.ring.writers, directory=str(write_path))
+        self.stats_writer = FrameStatsWriter(write_path) if config["recorder"].getboolean("write_stats") else None
+
+        self.previews = queue.Queue(1) if previews else None
+        frames = queue.Queue(config["recorder"].getint("write_queue"))
+        self.capture = CaptureStage(self, cam, frames, self.previews, chipid)
+        self.writer = WriteStage(frames, self.ring, codec, write_path, recording, self.stats_writer)
+
+    def start(self, camera: SeekCamera):
+        self.camera = camera
+        self.capture.start()
+        self.writer.start()
+        camera.color_palette = SeekCameraColorPalette.TYRIAN
+        camera.register_frame_available_callback(on_frame, self)
+        camera.capture_session_start(SeekCameraFrameFormat.THERMOGRAPHY_FLOAT)
+
+    def stats(self) -> list[str]:
+        return [self.writer.status, self.ring.stats(), self.capture.pairing.stats(), str(self.capture.stats), str(self.writer.stats)]
+
+    def close(self):
+        '''Stops the camera and writes the frames that were already captured.'''
+        if self.camera:
+            self.camera.capture_session_stop()
+            self.camera = None
+        self.capture.stop()
+        self.writer.stop()
+        self.ring.close()
+        if self.sequence:
+            self.sequence.close()
+        if self.stats_writer:
+            self.stats_writer.close()
+
+class RecordingSession:
+    '''
+    Everything a recording needs besides a UI: the webcam and one CameraSession per connected thermal camera.
+    Captured frames are written while recording() is true, with previews every camera keeps its newest frame.
+    '''
+    def __init__(self, recording: Callable[[], bool], previews: bool = False):
+        cid = config["recorder"].get("camera")
+        try:
+            cid = int(cid)
+        except ValueError:
+            pass
+        self.cam = BufferlessVideoCapture(cid)
+        self.recording = recording
+        self.previews = previews
+        self.cameras: dict[str, CameraSession] = {}
+        self.lock = Lock()
+        self.written = 0 # Frames of cameras that were disconnected
+
+    def start(self, manager: SeekCameraManager):
+        manager.register_event_callback(on_event, self)
+
+    def connect(self, camera: SeekCamera):
+        with self.lock:
+            if str(camera.chipid) in self.cameras:
+                return
+            session = CameraSession(str(camera.chipid), self.cam, self.recording, self.previews, len(self.cameras) + 1)
+            self.cameras[session.chipid] = session
+        session.start(camera)
+
+    def disconnect(self, camera: SeekCamera):
+        self.remove(str(camera.chipid))
+
+    def remove(self, chipid: str):
+        with self.lock:
+            session = self.cameras.pop(chipid, None)
+        if session:
+            session.close()
+            self.written += session.ring.written.value
+
+    def sessions(self) -> list[CameraSession]:
+        with self.lock:
+            return list(self.cameras.values())
+
+    def frames_written(self) -> int:
+        return self.written + sum(i.ring.written.value for i in self.sessions())
+
+    def stats(self) -> list[str]:
+        lines = [self.cam.stats()]
+        for session in self.sessions():
+            lines += [f"{session.chipid}: {line}" for line in session.stats()]
+        return lines
+
+    def close(self):
+        for session in self.sessions():
+            self.remove(session.chipid)
+        self.cam.close()
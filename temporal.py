@@ -0,0 +1,182 @@
+import os
+import argparse
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import exrutils
+import fsutils
+from frameindex import FrameIndex
+from parallel import ordered_map
+from config import config
+
+MAPS = ["arrival", "peak", "peak_time", "max_gradient"]
+SERIES = ["gradient", "mean", "std"]
+NEVER = -1.0 # Arrival time of pixels that never reach the isotherm
+
+'''
+Per-pixel time series of a recording. The thermal frames are streamed into a memory mapped (time, y, x) cube, which
+is then cut into bands of rows that hold every frame. Each band is analyzed with vectorized NumPy in a process pool,
+so memory stays bounded by the band size no matter how long the recording is.
+
+Maps, one image each, times are seconds since the first frame:
+arrival       first time a pixel reaches the isotherm, interpolated between frames, NEVER if it doesn't
+peak          highest temperature
+peak_time     time of the highest temperature
+max_gradient  steepest rise in °C/s
+
+Series, one image per frame:
+gradient      dT/dt in °C/s
+mean, std     rolling mean and standard deviation over the last window frames
+'''
+def frame_times(files: FrameIndex) -> np.ndarray:
+    '''Seconds since the first frame, frame numbers if the names hold no timestamps.'''
+    if files.valid:
+        return ((files.timestamps - files.timestamps[0]) / 1000.0).astype(np.float64)
+    return np.arange(len(files), dtype=np.float64)
+
+def read_chunk(files: FrameIndex) -> np.ndarray:
+    frames = (files.read_thermal(i) for i in range(len(files)))
+    return np.stack([i.reshape(i.shape[:2]) for i in frames])
+
+def build_cube(files: FrameIndex, path: str | Path, workers: int = 1, chunk_size: int = 64) -> np.ndarray:
+    '''Reads every thermal frame into a float32 (time, y, x) .npy memory map at path.'''
+    shape = files.read_thermal(0).shape[:2]
+    cube = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(len(files),) + shape)
+    chunks = ((files[i:i+chunk_size],) for i in range(0, len(files), chunk_size))
+    start = 0
+    for frames in ordered_map(read_chunk, chunks, workers):
+        cube[start:start+len(frames)] = frames
+        start += len(frames)
+    cube.flush()
+    return cube
+
+def rolling(tile: np.ndarray, window: int) -> tuple[np.ndarray, np.ndarray]:
+    '''Mean and standard deviation over the last window frames along axis 0, the first frames use the frames so far.'''
+    total = np.cumsum(tile, axis=0, dtype=np.float64)
+    squares = np.cumsum(np.square(tile, dtype=np.float64), axis=0)
+    total[window:] -= total[:-window].copy()
+    squares[window:] -= squares[:-window].copy()
+    count = np.minimum(np.arange(1, len(tile)+1), window).reshape(-1, 1, 1)
+    mean = total / count
+    var = np.maximum(squares / count - np.square(mean), 0.0)
+    return mean.astype(np.float32), np.sqrt(var).astype(np.float32)
+
+def arrival_time(tile: np.ndarray, times: np.ndarray, isotherm: float) -> np.ndarray:
+    reached = tile >= isotherm
+    first = reached.argmax(axis=0)
+    never = ~reached.any(axis=0)
+    # Linear interpolation between the last frame below and the first frame at or above the isotherm
+    before = np.maximum(first - 1, 0)
+    t0 = np.take_along_axis(tile, before[None], axis=0)[0]
+    t1 = np.take_along_axis(tile, first[None], axis=0)[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(first > 0, (isotherm - t0) / (t1 - t0), 1.0)
+    arrival = times[before] + np.clip(np.nan_to_num(fraction, nan=1.0), 0.0, 1.0) * (times[first] - times[before])
+    arrival[never] = NEVER
+    return arrival.astype(np.float32)
+
+def analyze_tile(cube_path: str, series_paths: dict[str, str], rows: tuple[int,int], times: np.ndarray, isotherm: float, window: int) -> tuple[tuple[int,int], dict[str, np.ndarray]]:
+    '''Maps of the rows of the cube, the series are written into their memory maps directly since the bands don't overlap.'''
+    tile = np.array(np.load(cube_path, mmap_mode="r")[:, rows[0]:rows[1]])
+    gradient = np.gradient(tile, times, axis=0).astype(np.float32) if len(tile) > 1 else np.zeros_like(tile)
+    peak = tile.argmax(axis=0)
+    maps = {
+        "arrival": arrival_time(tile, times, isotherm),
+        "peak": tile.max(axis=0),
+        "peak_time": times[peak].astype(np.float32),
+        "max_gradient": gradient.max(axis=0),
+    }
+    if series_paths:
+        series = {"gradient": gradient}
+        if "mean" in series_paths or "std" in series_paths:
+            series["mean"], series["std"] = rolling(tile, window)
+        for name, path in series_paths.items():
+            out = np.load(path, mmap_mode="r+")
+            out[:, rows[0]:rows[1]] = series[name]
+            out.flush()
+    return rows, maps
+
+def tile_rows(shape: tuple[int,int,int], tile_mb: float) -> int:
+    # The band, its gradient and the float64 running sums of the rolling statistics are held at once
+    per_row = shape[0] * shape[2] * 4 * 8
+    return int(min(max(tile_mb * 2**20 // per_row, 1), shape[1]))
+
+def visible_image(files: FrameIndex, i: int) -> np.ndarray:
+    return files.read_dual_image(i)[0]
+
+def frame_file_name(name: str) -> str:
+    name = os.path.basename(str(name))
+    return name if name.endswith(".exr") else name + ".exr"
+
+def write_series_chunk(files: FrameIndex, start: int, series_paths: dict[str, str], outpath: Path) -> int:
+    series = {name: np.load(path, mmap_mode="r") for name, path in series_paths.items()}
+    for i in range(len(files)):
+        rgb = visible_image(files, i)
+        for name, cube in series.items():
+            exrutils.write_dual_image(rgb, np.array(cube[start+i]), str(outpath / name / frame_file_name(files.names[i])), visible_format="uint")
+    return len(files)
+
+def analyze(files: FrameIndex, outpath: str | Path, isotherm: float, window: int, series: Optional[list[str]] = None, workers: int = 1, chunk_size: int = 64, tile_mb: float = 256.0, keep_cube: bool = False) -> dict[str, np.ndarray]:
+    '''
+    Writes the maps to outpath/maps/<name>.exr and every series to outpath/<name>/ with the frame names of files.
+    The cube and the series are memory mapped in outpath while they are computed. Returns the maps.
+    '''
+    outpath = Path(outpath)
+    os.makedirs(outpath / "maps", exist_ok=True)
+    times = frame_times(files)
+    cube_path = str(outpath / "cube.npy")
+    cube = build_cube(files, cube_path, workers, chunk_size)
+
+    series_paths = {}
+    for name in series or []:
+        os.makedirs(outpath / name, exist_ok=True)
+        series_paths[name] = str(outpath / f"{name}.npy")
+        np.lib.format.open_memmap(series_paths[name], mode="w+", dtype=np.float32, shape=cube.shape).flush()
+
+    maps = {name: np.zeros(cube.shape[1:], dtype=np.float32) for name in MAPS}
+    step = tile_rows(cube.shape, tile_mb)
+    tiles = ((cube_path, series_paths, (y, min(y+step, cube.shape[1])), times, isotherm, window) for y in range(0, cube.shape[1], step))
+    for rows, tile_maps in ordered_map(analyze_tile, tiles, workers):
+        for name, values in tile_maps.items():
+            maps[name][rows[0]:rows[1]] = values
+
+    rgb = visible_image(files, 0)
+    for name, values in maps.items():
+        exrutils.write_dual_image(rgb, values, str(outpath / "maps" / f"{name}.exr"), visible_format="uint")
+    if series_paths:
+        chunks = ((files[i:i+chunk_size], i, series_paths, outpath) for i in range(0, len(files), chunk_size))
+        for _ in ordered_map(write_series_chunk, chunks, workers):
+            pass
+
+    del cube
+    for path in series_paths.values():
+        os.remove(path)
+    if not keep_cube:
+        os.remove(cube_path)
+    return maps
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Temporal analysis", description="Per-pixel time series maps of a recording: isotherm arrival, peak, peak time and steepest rise, optionally dT/dt and rolling mean/std of every frame")
+    parser.add_argument("start_path")
+    parser.add_argument("end_path", nargs="?")
+    parser.add_argument("-o", "--out", default=config["analysis"].get("out_path"))
+    parser.add_argument("--isotherm", type=float, default=config["analysis"].getfloat("isotherm"), help="°C")
+    parser.add_argument("--window", type=int, default=config["analysis"].getint("window"), help="Frames of the rolling mean and std")
+    parser.add_argument("--series", default=config["analysis"].get("series"), help=f"Comma separated series written per frame, any of {','.join(SERIES)}")
+    parser.add_argument("--tile-mb", type=float, default=config["analysis"].getfloat("tile_mb"), help="Memory per band of rows")
+    parser.add_argument("--keep-cube", action="store_true", help="Keep the (time, y, x) cube.npy")
+    parser.add_argument("-j", "--workers", type=int, default=config["export"].getint("workers"), help="Worker processes, 0 uses every core")
+    parser.add_argument("--chunk-size", type=int, default=config["export"].getint("chunk_size"), help="Frames per work item")
+    args = parser.parse_args()
+
+    series = [i for i in args.series.split(",") if i]
+    for i in series:
+        if i not in SERIES:
+            parser.error(f"Unknown series {i}, use any of {SERIES}")
+    files = fsutils.file_range_sharp_start(args.start_path, args.end_path)
+    if not len(files):
+        parser.error("No frames found")
+    analyze(files, args.out, args.isotherm, args.window, series, args.workers if args.workers > 0 else os.cpu_count(), args.chunk_size, args.tile_mb, args.keep_cube)
+    print(f"Wrote {len(files)} frames of analysis to {args.out}, open {os.path.join(args.out, 'maps')} in the player")
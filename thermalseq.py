@@ -0,0 +1,402 @@
+import io
+import os
+import math
+import mmap
+import threading
+import struct
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import exrutils
+import deltacodec
+from frameindex import FrameIndex, parse_names
+from zipindex import MemoryStream
+
+'''
+Single file frame sequence, .thseq
+
+header:     MAGIC, version, block size, padded to one block
+chunks:     CHUNK_MAGIC, kind, timestamp, frame number, data size, then the frame, padded to whole blocks
+            KIND_EXR:   the frame as an EXR file
+            KIND_DELTA: size of the thermal data and its capture time (ms since the epoch, NaN if unknown), the thermal
+                        image encoded by deltacodec, the visible image as an EXR file
+index:      INDEX_DTYPE records sorted by frame name, written when the writer is closed
+footer:     index offset, record count, INDEX_MAGIC
+
+EXR chunks are independently compressed frames, so the exrutils readers (selective reads included) work on a
+memory mapped chunk. A sequence that is still being recorded has no index yet, readers find the chunks by scanning.
+Delta frames reference the data offset of the previous frame, the chain ends at a keyframe.
+'''
+SUFFIX = ".thseq"
+MAGIC = b"THSEQ\0\0\0"
+VERSION = 1
+BLOCK = 4096
+HEADER = struct.Struct("<8sII")
+CHUNK_MAGIC = b"THFR"
+CHUNK_HEADER = struct.Struct("<4sIqqQ") # magic, kind, timestamp, frame number, data size
+KIND_EXR = 0
+KIND_DELTA = 1
+DELTA_HEADER = struct.Struct("<Id") # thermal data size, thermal capture time
+FOOTER = struct.Struct("<QQ8s") # index offset, record count, magic
+INDEX_MAGIC = b"THSEQIDX"
+INDEX_DTYPE = np.dtype([("timestamp", "<i8"), ("frame", "<i8"), ("offset", "<u8"), ("size", "<u8")])
+
+def frame_name(timestamp: int, frame: int) -> str:
+    return f"{timestamp}:{frame:04}.exr"
+
+def chunk_size(data_size: int) -> int:
+    return -(-(CHUNK_HEADER.size + data_size) // BLOCK) * BLOCK
+
+def read_index(buf) -> Optional[tuple[np.ndarray, int]]:
+    '''The trailing index and where the chunks end, None if the sequence was not closed.'''
+    if len(buf) < BLOCK + FOOTER.size:
+        return None
+    offset, count, magic = FOOTER.unpack_from(buf, len(buf) - FOOTER.size)
+    if magic != INDEX_MAGIC or offset + count*INDEX_DTYPE.itemsize + FOOTER.size != len(buf):
+        return None
+    return np.frombuffer(buf, dtype=INDEX_DTYPE, count=count, offset=offset).copy(), offset
+
+def scan(buf, pos: int) -> tuple[np.ndarray, int]:
+    '''Complete chunks from pos on and the end of the last one.'''
+    records = []
+    while pos + CHUNK_HEADER.size <= len(buf):
+        magic, _, timestamp, frame, size = CHUNK_HEADER.unpack_from(buf, pos)
+        if magic != CHUNK_MAGIC or pos + CHUNK_HEADER.size + size > len(buf):
+            break # The index or a chunk that is still being written
+        records.append((timestamp, frame, pos + CHUNK_HEADER.size, size))
+        pos += chunk_size(size)
+    return np.array(records, dtype=INDEX_DTYPE), pos
+
+def check_header(buf):
+    magic, version, block = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION or block != BLOCK:
+        raise ValueError("Not a thermal sequence file")
+
+class SequenceFrameIndex(FrameIndex):
+    '''
+    Frames of a .thseq file, read through a memory map. Sequences that are being recorded are followed by update().
+    Frame statistics are looked up in the directory of the file.
+    '''
+    def __init__(self, sequence_path: str | Path):
+        self.sequence_path = Path(sequence_path).resolve()
+        self.chunks: dict[str, tuple[int,int]] = {}
+        self.scan_pos = 0
+        self.size = 0
+        self._delta_lock = threading.Lock()
+        self._delta_cache: Optional[tuple[int, np.ndarray, deltacodec.Header]] = None # Last decoded delta frame
+        super().__init__(self.sequence_path.parent, np.array([], dtype=str), np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        self._open()
+        self.update()
+
+    def _open(self):
+        self.owner = True # Slices share the file, only the index that opened it closes it when it is collected
+        self._file = open(self.sequence_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Open handles can't be pickled, worker processes reopen the file
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for i in ["_file", "_map", "_delta_lock"]:
+            del state[i]
+        state["chunks"] = {str(i): self.chunks[str(i)] for i in self.names}
+        state["_delta_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._delta_lock = threading.Lock()
+        self._open()
+
+    def __getitem__(self, key):
+        view = super().__getitem__(key)
+        if isinstance(key, slice):
+            view.owner = False
+        return view
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass # A frame is still being read from the map, it is unmapped once that is done
+        self._file.close()
+
+    def __del__(self):
+        if getattr(self, "owner", False):
+            self.close()
+
+    def update(self) -> int:
+        '''Adds the chunks appended since the last call, returns the number of new frames.'''
+        if not self.live:
+            return 0
+        size = os.path.getsize(self.sequence_path)
+        if size == self.size:
+            return 0
+        # Views into the old map may still be in use, it is closed once they are gone
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.size == 0:
+            check_header(self._map)
+            self.scan_pos = BLOCK
+            index = read_index(self._map)
+            if index:
+                records, self.scan_pos = index
+                self._add(records)
+        self.size = size
+        records, self.scan_pos = scan(self._map, self.scan_pos)
+        self._add(records)
+        return len(records)
+
+    def _add(self, records: np.ndarray):
+        if len(records) == 0:
+            return
+        new = [frame_name(int(t), int(f)) for t, f in zip(records["timestamp"], records["frame"])]
+        for name, offset, size in zip(new, records["offset"].tolist(), records["size"].tolist()):
+            self.chunks[name] = (offset, size)
+        names = np.concatenate([self.names, np.array(new, dtype=str)])
+        order = np.argsort(names, kind="stable")
+        self.names = names[order]
+        self.timestamps = np.concatenate([self.timestamps, records["timestamp"]])[order]
+        self.frame_numbers = np.concatenate([self.frame_numbers, records["frame"]])[order]
+        self._frame_order = None
+        self._sorted_frame_numbers = None
+
+    def save(self):
+        pass
+
+    def path(self, i: int) -> str:
+        return f"{self.sequence_path}/{self.names[i]}"
+
+    def kind(self, i: int) -> int:
+        offset, _ = self.chunks[str(self.names[i])]
+        return CHUNK_HEADER.unpack_from(self._map, offset - CHUNK_HEADER.size)[1]
+
+    def source(self, i: int) -> io.RawIOBase:
+        '''The EXR file of the frame, for delta frames only the visible part.'''
+        offset, size = self.chunks[str(self.names[i])]
+        view = memoryview(self._map)[offset:offset+size]
+        if self.kind(i) == KIND_DELTA:
+            view = view[DELTA_HEADER.size + DELTA_HEADER.unpack_from(view)[0]:]
+        return MemoryStream(view)
+
+    def _thermal_data(self, offset: int) -> memoryview:
+        size = DELTA_HEADER.unpack_from(self._map, offset)[0]
+        return memoryview(self._map)[offset+DELTA_HEADER.size:offset+DELTA_HEADER.size+size]
+
+    def _delta_thermal(self, i: int) -> np.ndarray:
+        # Sequential reads apply one delta to the cached frame, seeks decode from the last keyframe
+        start = offset = self.chunks[str(self.names[i])][0]
+        with self._delta_lock:
+            chain = []
+            bits = None
+            while True:
+                if self._delta_cache and self._delta_cache[0] == offset:
+                    bits = self._delta_cache[1]
+                    break
+                data = self._thermal_data(offset)
+                header = deltacodec.Header(data)
+                chain.append((data, header))
+                if header.keyframe:
+                    break
+                offset = header.reference
+            for data, _ in reversed(chain):
+                bits = deltacodec.decode(data, bits)
+            header = chain[0][1] if chain else self._delta_cache[2]
+            self._delta_cache = (start, bits, header)
+        return deltacodec.from_bits(bits, header)
+
+    def read_dual_image(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        if self.kind(i) != KIND_DELTA:
+            return super().read_dual_image(i)
+        return exrutils.read_visible_image(self.source(i)), self._delta_thermal(i)
+
+    def read_thermal(self, i: int, rows: Optional[tuple[int,int]] = None) -> np.ndarray:
+        if self.kind(i) != KIND_DELTA:
+            return super().read_thermal(i, rows)
+        thermal = self._delta_thermal(i)
+        return thermal[rows[0]:rows[1]] if rows else thermal
+
+    def read_pixels(self, i: int, points: np.ndarray) -> np.ndarray:
+        if self.kind(i) != KIND_DELTA:
+            return super().read_pixels(i, points)
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        return self._delta_thermal(i)[points[:,1], points[:,0]]
+
+    def read_capture_times(self, i: int) -> dict[str, Optional[float]]:
+        times = super().read_capture_times(i)
+        if self.kind(i) == KIND_DELTA:
+            thermal_time = DELTA_HEADER.unpack_from(self._map, self.chunks[str(self.names[i])][0])[1]
+            times["infrared"] = None if math.isnan(thermal_time) else thermal_time
+        return times
+
+class SequenceWriter:
+    '''
+    Appends frames to a .thseq file, an existing sequence is continued. Usable as the write function of a FrameRing,
+    the writer processes share a lock and append whole chunks. close() writes the index once all writers are done.
+    '''
+    def __init__(self, sequence_path: str | Path, lock=None):
+        self.sequence_path = Path(sequence_path)
+        self.lock = lock or mp.Lock()
+        self._fd: Optional[int] = None
+        os.makedirs(self.sequence_path.parent, exist_ok=True)
+        with open(self.sequence_path, "ab+") as f:
+            if f.tell() == 0:
+                f.write(HEADER.pack(MAGIC, VERSION, BLOCK).ljust(BLOCK, b"\0"))
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                check_header(buf)
+                index = read_index(buf)
+                # Drops the index, or a chunk that was cut off when the recorder stopped
+                end = index[1] if index else scan(buf, BLOCK)[1]
+            f.truncate(end)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_fd"] = None
+        return state
+
+    def append(self, data: bytes, timestamp: int, frame: int, kind: int = KIND_EXR) -> int:
+        '''Returns the offset of the data in the file.'''
+        chunk = CHUNK_HEADER.pack(CHUNK_MAGIC, kind, timestamp, frame, len(data)) + data
+        chunk += b"\0" * (chunk_size(len(data)) - len(chunk))
+        with self.lock:
+            if self._fd is None:
+                self._fd = os.open(self.sequence_path, os.O_WRONLY | os.O_APPEND)
+            offset = os.lseek(self._fd, 0, os.SEEK_END)
+            os.write(self._fd, chunk)
+        return offset + CHUNK_HEADER.size
+
+    def __call__(self, rgb_image: np.ndarray, thermal_image: np.ndarray, file_name: str, **options):
+        '''Same arguments as exrutils.write_dual_image, the timestamp and frame number are taken from file_name.'''
+        timestamps, frame_numbers = parse_names([file_name])
+        data = io.BytesIO()
+        exrutils.write_dual_image(rgb_image, thermal_image, data, **options)
+        self.append(data.getvalue(), int(timestamps[0]), int(frame_numbers[0]))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        with open(self.sequence_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            records, end = scan(buf, BLOCK)
+        names = [frame_name(int(t), int(f)) for t, f in zip(records["timestamp"], records["frame"])]
+        records = records[np.argsort(np.array(names, dtype=str), kind="stable")]
+        with open(self.sequence_path, "r+b") as f:
+            f.truncate(end)
+            f.seek(end)
+            f.write(records.tobytes())
+            f.write(FOOTER.pack(end, len(records), INDEX_MAGIC))
+
+class DeltaSequenceWriter(SequenceWriter):
+    '''
+    Stores the thermal images as keyframes and deltas (deltacodec) and the visible images as EXR files.
+    The deltas need the frames in order, so a FrameRing may only use one writer process.
+    '''
+    def __init__(self, sequence_path: str | Path, interval: int = 30, level: int = 1, lock=None):
+        super().__init__(sequence_path, lock)
+        self.interval = interval
+        self.level = level
+        self.encoder: Optional[deltacodec.DeltaEncoder] = None
+        self.reference = -1
+
+    def __call__(self, rgb_image: np.ndarray, thermal_image: np.ndarray, file_name: str, visible_format: str = "float", visible_downscale: int = 1, visible_compression: Optional[str] = None,
+                 thermal_format: str = "float", thermal_quantization: tuple[float,float] = exrutils.THERMAL_QUANTIZATION, visible_time: Optional[float] = None, thermal_time: Optional[float] = None,
+                 camera: Optional[str] = None, **options):
+        '''Same arguments as exrutils.write_dual_image, the thermal compression is replaced by the deltas.'''
+        timestamps, frame_numbers = parse_names([file_name])
+        if self.encoder is None or self.encoder.format != thermal_format or self.encoder.quantization != tuple(thermal_quantization):
+            self.encoder = deltacodec.DeltaEncoder(thermal_format, tuple(thermal_quantization), self.interval, self.level)
+        thermal = self.encoder.encode(thermal_image, self.reference)
+        visible = io.BytesIO()
+        exrutils.write_visible_image(rgb_image, visible, visible_format, visible_downscale, visible_compression, visible_time, camera)
+        header = DELTA_HEADER.pack(len(thermal), math.nan if thermal_time is None else thermal_time)
+        self.reference = self.append(header + thermal + visible.getvalue(), int(timestamps[0]), int(frame_numbers[0]), KIND_DELTA)
+
+def capture_times(files: FrameIndex, i: int) -> dict[str, Optional[float]]:
+    '''The capture times of frame i as write_dual_image arguments.'''
+    times = files.read_capture_times(i)
+    return {"visible_time": times.get("visible"), "thermal_time": times.get("infrared")}
+
+def read_bytes(files: FrameIndex, i: int) -> bytes:
+    '''The frame as an EXR file, delta frames are encoded again.'''
+    if isinstance(files, SequenceFrameIndex) and files.kind(i) == KIND_DELTA:
+        data = io.BytesIO()
+        exrutils.write_dual_image(*files.read_dual_image(i), data, **capture_times(files, i))
+        return data.getvalue()
+    source = files.source(i)
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    return source.read()
+
+def pack(files: FrameIndex, sequence_path: str | Path) -> int:
+    '''Copies the EXR frames of a directory or zip into a sequence without decoding them.'''
+    if not files.valid:
+        raise ValueError("Only frames named <ms>:<frame>.exr can be packed")
+    writer = SequenceWriter(sequence_path)
+    for i in range(len(files)):
+        writer.append(read_bytes(files, i), int(files.timestamps[i]), int(files.frame_numbers[i]))
+    writer.close()
+    return len(files)
+
+def transcode(files: FrameIndex, sequence_path: str | Path, delta: bool = True, interval: int = 30, level: int = 1, **options) -> int:
+    '''Decodes every frame and writes it again with the write_dual_image options, as deltas or as EXR chunks.'''
+    if not files.valid:
+        raise ValueError("Only frames named <ms>:<frame>.exr can be transcoded")
+    writer = DeltaSequenceWriter(sequence_path, interval, level) if delta else SequenceWriter(sequence_path)
+    for i in range(len(files)):
+        writer(*files.read_dual_image(i), frame_name(int(files.timestamps[i]), int(files.frame_numbers[i])), **capture_times(files, i), **options)
+    writer.close()
+    return len(files)
+
+def unpack(sequence_path: str | Path, directory: str | Path) -> int:
+    '''Writes every frame of a sequence as an EXR file.'''
+    files = SequenceFrameIndex(sequence_path)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(len(files)):
+        with open(Path(directory) / str(files.names[i]), "wb") as f:
+            f.write(read_bytes(files, i))
+    return len(files)
+
+if __name__ == "__main__":
+    import fsutils
+    from config import config
+
+    parser = argparse.ArgumentParser(prog="Thermal sequence", description="Converts between recordings and single file .thseq sequences")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="Directory or zip to .thseq")
+    pack_parser.add_argument("source")
+    pack_parser.add_argument("out")
+    transcode_parser = subparsers.add_parser("transcode", help="Any recording to .thseq, re-encoding every frame")
+    transcode_parser.add_argument("source")
+    transcode_parser.add_argument("out")
+    transcode_parser.add_argument("--exr", action="store_true", help="EXR chunks instead of thermal deltas")
+    transcode_parser.add_argument("-k", "--keyframe-interval", type=int, default=config["recorder"].getint("keyframe_interval"))
+    transcode_parser.add_argument("--level", type=int, default=config["recorder"].getint("delta_level"), help="zlib level of the deltas")
+    transcode_parser.add_argument("--visible-format", choices=exrutils.VISIBLE_FORMATS, default=config["recorder"].get("visible_format"))
+    transcode_parser.add_argument("--visible-downscale", type=int, default=config["recorder"].getint("visible_downscale"))
+    transcode_parser.add_argument("--visible-compression", choices=list(exrutils.COMPRESSIONS))
+    transcode_parser.add_argument("--thermal-format", choices=exrutils.THERMAL_FORMATS, default=config["recorder"].get("thermal_format"))
+    transcode_parser.add_argument("--thermal-compression", choices=list(exrutils.COMPRESSIONS), help="Only for --exr")
+    unpack_parser = subparsers.add_parser("unpack", help=".thseq to a directory of EXR frames")
+    unpack_parser.add_argument("source")
+    unpack_parser.add_argument("out")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        print(f"Packed {pack(fsutils.file_range(args.source)[0], args.out)} frames")
+    elif args.command == "transcode":
+        options = {
+            "visible_format": args.visible_format,
+            "visible_downscale": args.visible_downscale,
+            "visible_compression": args.visible_compression,
+            "thermal_format": args.thermal_format,
+            "thermal_quantization": (config["recorder"].getfloat("thermal_scale"), config["recorder"].getfloat("thermal_offset")),
+        }
+        if args.exr:
+            options["thermal_compression"] = args.thermal_compression
+        print(f"Transcoded {transcode(fsutils.file_range(args.source)[0], args.out, not args.exr, args.keyframe_interval, args.level, **options)} frames")
+    else:
+        print(f"Unpacked {unpack(args.source, args.out)} frames")
@@ -1,30 +1,90 @@
 import cv2
+import time
 import threading
+from collections import deque
+from typing import Optional
+
+import numpy as np
 
 class BufferlessVideoCapture:
-    def __init__(self, name):
+    '''
+    Grabs and decodes frames on its own thread and publishes only the newest one.
+    The published (frame, timestamp, sequence number) tuple is replaced by a single assignment and frames are never
+    reused, so read() needs no lock and a frame that is being used is never overwritten.
+    The last few frames are kept so frames from another camera can be matched by capture time.
+    '''
+    def __init__(self, name, history: int = 8):
         self.cap = cv2.VideoCapture(name)
-        self.lock = threading.Lock()
         self.closed = False
+        self.latest: tuple[Optional[np.ndarray], float, int] = (None, 0.0, -1)
+        self.history: deque[tuple[np.ndarray, float, int]] = deque(maxlen=history)
+        self.read_seq = -1
+        self.grabbed = 0
+        self.dropped = 0 # Frames replaced before they were read
+        self.fps = 0.0
         self.t = threading.Thread(target=self._reader)
         self.t.daemon = True
         self.t.start()
         print(f"Opened camera {name} {type(name)}")
-    # grab frames as soon as they are available
+
+    # grab and decode frames as soon as they are available
     def _reader(self):
-        while True:
-            with self.lock:
-                ret = self.cap.grab()
-            if not ret:
+        last = None
+        while not self.closed:
+            ret, frame = self.cap.read()
+            if not ret or self.closed:
                 break
+            now = time.time()
+            if last is not None and now > last:
+                rate = 1.0 / (now - last)
+                self.fps = rate if self.fps == 0.0 else 0.9 * self.fps + 0.1 * rate
+            last = now
+            previous_seq = self.latest[2]
+            if previous_seq >= 0 and self.read_seq != previous_seq:
+                self.dropped += 1
+            self.latest = (frame, now, self.grabbed)
+            self.history.append(self.latest)
+            self.grabbed += 1
+        if self.closed:
+            self.cap.release() # In case close() gave up waiting for a stalled read, releasing twice is harmless
 
-    # retrieve latest frame
-    def read(self):
-        with self.lock:
-            _, frame = self.cap.retrieve()
+    # latest frame with its capture time (s) and sequence number, None before the first frame
+    def read(self) -> tuple[Optional[np.ndarray], float, int]:
+        latest = self.latest
+        self.read_seq = latest[2]
+        return latest
+
+    # frame captured closest to timestamp (s)
+    def nearest(self, timestamp: float) -> tuple[Optional[np.ndarray], float, int]:
+        frames = list(self.history)
+        if not frames:
+            return self.latest
+        frame = min(frames, key=lambda i: abs(i[1] - timestamp))
+        self.read_seq = max(self.read_seq, frame[2])
         return frame
 
+    def stats(self) -> str:
+        return f"camera {self.fps:.1f} fps, grabbed {self.grabbed}, dropped {self.dropped}"
+
     def close(self):
-        with self.lock:
-            self.closed = True
+        self.closed = True
+        self.t.join(1.0) # The reader may be waiting for one more frame
+        # Releasing while the reader is inside cap.read() is undefined, a stalled reader releases the capture itself
+        if not self.t.is_alive():
             self.cap.release()
+
+class PairingStats:
+    '''Capture time offsets between paired frames over the last window pairs.'''
+    def __init__(self, window: int = 100):
+        self.offsets: deque[float] = deque(maxlen=window)
+        self.pairs = 0
+
+    def add(self, offset: float):
+        self.offsets.append(offset)
+        self.pairs += 1
+
+    def stats(self) -> str:
+        if not self.offsets:
+            return "pairing: no frames"
+        offsets = np.array(self.offsets) * 1000
+        return f"pairing offset {offsets[-1]:+.1f} ms, mean {offsets.mean():+.1f} ms, max {np.abs(offsets).max():.1f} ms, jitter {offsets.std():.1f} ms"
@@ -0,0 +1,109 @@
+import io
+import mmap
+import struct
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from frameindex import FrameIndex, parse_names
+
+LOCAL_HEADER = struct.Struct("<4s22xHH") # signature, ..., file name length, extra field length
+
+class MemoryStream(io.RawIOBase):
+    '''Seekable read only stream over a memoryview, reads copy straight out of the map.'''
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(min(len(b), len(self.view)-self.pos), 0)
+        b[:n] = self.view[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = offset
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+class ZipFrameIndex(FrameIndex):
+    '''
+    Frames inside a zip archive, listed from the central directory and decoded one member at a time.
+    Stored (uncompressed) members are read through a memory map of the archive.
+    '''
+    def __init__(self, archive_path: str | Path):
+        self.archive_path = Path(archive_path).resolve()
+        self._open_archive()
+        infos = sorted((i for i in self.archive.infolist() if i.filename.endswith(".exr") and not i.is_dir()), key=lambda i: i.filename)
+        self.infos = {i.filename: i for i in infos}
+
+        names = [i.filename for i in infos]
+        super().__init__(self.archive_path, np.array(names, dtype=str), *parse_names(names), live=False)
+
+    def _open_archive(self):
+        self.owner = True # Slices share the handles, only the index that opened them closes them when it is collected
+        self.archive = zipfile.ZipFile(self.archive_path, "r")
+        self._file = open(self.archive_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Open handles can't be pickled, worker processes reopen the archive
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for i in ["archive", "_file", "_map"]:
+            del state[i]
+        state["infos"] = {str(i): self.infos[str(i)] for i in self.names}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open_archive()
+
+    def __getitem__(self, key):
+        view = super().__getitem__(key)
+        if isinstance(key, slice):
+            view.owner = False
+        return view
+
+    def close(self):
+        self.archive.close()
+        try:
+            self._map.close()
+        except BufferError:
+            pass # A frame is still being read from the map, it is unmapped once that is done
+        self._file.close()
+
+    def __del__(self):
+        if getattr(self, "owner", False):
+            self.close()
+
+    def update(self) -> int:
+        return 0
+
+    def save(self):
+        pass
+
+    def path(self, i: int) -> str:
+        return f"{self.archive_path}/{self.names[i]}"
+
+    def source(self, i: int) -> io.RawIOBase:
+        info = self.infos[str(self.names[i])]
+        if info.compress_type == zipfile.ZIP_STORED:
+            signature, name_length, extra_length = LOCAL_HEADER.unpack_from(self._map, info.header_offset)
+            if signature != b"PK\x03\x04":
+                raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+            start = info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+            return MemoryStream(memoryview(self._map)[start:start+info.file_size])
+        return io.BytesIO(self.archive.read(info))